@@ -0,0 +1,227 @@
+"""
+Rolling-window aggregates for the PWS client
+Keeps the min/max/mean of selected telemetry fields and the increase of cumulative counters
+(e.g. totalrainin) per station over a few fixed windows, so dashboards do not need expensive
+range queries over every station series.
+
+Each window is a ring of fixed-width buckets, a sample only updates the current bucket of each
+window and the buckets older than the window are ignored when the gauges are built at scrape time.
+Memory per station is fixed - windows x buckets x (4 x fields + counters) floats - and the window
+edge is accurate to one bucket width (1/60 of the window by default).
+
+    <field>_min, <field>_max, <field>_mean   - gauges with station and window labels
+    <counter>_increase                       - sum of the positive increments, a reset counts from 0
+"""
+
+import math
+import threading
+import time
+from array import array
+
+import numpy as np
+from prometheus_client.core import GaugeMetricFamily
+
+UNITS: dict[str, int] = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_windows(text: str) -> list[str]:
+    """Check a comma separated list of windows e.g. "1m,10m,1h,24h"
+
+    Args:
+        text (str): windows as a number followed by s, m, h or d
+
+    Returns:
+        list[str]: the windows, ValueError if one is invalid
+    """
+    windows = [w.strip() for w in text.split(",") if w.strip()]
+    for w in windows:
+        if w[-1:] not in UNITS or float(w[:-1]) <= 0:
+            raise ValueError(f"Invalid window {w}")
+    return windows
+
+
+class RollingAggregates:
+    """Per station rolling aggregates, also a Prometheus collector of the gauges.
+    The ring buffers of all the stations share flat arrays, one row per station, so
+    an update is a few array stores and a scrape reduces every station at once."""
+
+    def __init__(
+        self,
+        fields: list[str],
+        counters: list[str],
+        windows: list[str],
+        buckets: int = 60,
+        descs: dict[str, str] | None = None,
+    ) -> None:
+        """
+        Args:
+            fields (list[str]): telemetry fields aggregated as min/max/mean
+            counters (list[str]): cumulative telemetry fields exported as their increase
+            windows (list[str]): window labels e.g. ["1m", "1h"]
+            buckets (int): buckets per window
+            descs (dict[str, str], optional): field -> description used in the HELP text
+        """
+        self.fields = fields
+        self.counters = counters
+        self.windows = windows
+        self.buckets = buckets
+        self.descs = descs or {}
+        self.widths: list[float] = [
+            float(w[:-1]) * UNITS[w[-1]] / buckets for w in windows
+        ]
+        slots = len(windows) * buckets
+        self.slots = slots
+
+        # per bucket min, max, sum and count of each field, an empty bucket
+        self.empty = array("d", [math.inf, -math.inf, 0.0, 0.0] * len(fields))
+        self.nothing = array("d", [0.0] * len(counters))
+        # row of each station in the arrays, rows of dropped stations are reused
+        self.rows: dict[str, int] = {}
+        self.free: list[int] = []
+        self.epochs = array("q")  # bucket number held by each (row, window, bucket)
+        self.stats = array("d")  # (row, window, bucket, field, min/max/sum/count)
+        self.increases = array("d")  # (row, window, bucket, counter)
+        self.last = array("d")  # (row, counter) previous counter values
+        self.lock = threading.Lock()  # guards the arrays against the scrape thread
+
+    def _row(self, station: str) -> int:
+        """Row of a station, a new one starts out with empty buckets"""
+        row = self.free.pop() if self.free else len(self.rows)
+        self.rows[station] = row
+        slots = self.slots
+        C = len(self.counters)
+        epochs = array("q", [-1]) * slots
+        stats = self.empty * slots
+        increases = self.nothing * slots
+        last = array("d", [math.nan]) * C
+        if row * slots == len(self.epochs):
+            self.epochs.extend(epochs)
+            self.stats.extend(stats)
+            self.increases.extend(increases)
+            self.last.extend(last)
+        else:
+            self.epochs[row * slots : (row + 1) * slots] = epochs
+            self.stats[row * len(stats) : (row + 1) * len(stats)] = stats
+            self.increases[row * len(increases) : (row + 1) * len(increases)] = (
+                increases
+            )
+            self.last[row * C : (row + 1) * C] = last
+        return row
+
+    def update(self, station: str, record: dict, t: float) -> None:
+        """Add the converted telemetry of a station to the current bucket of each window
+
+        Args:
+            station (str): station identity
+            record (dict): converted telemetry, missing fields are skipped
+            t (float): ingest time
+        """
+        F4 = len(self.empty)
+        C = len(self.counters)
+        B = self.buckets
+        values = [
+            (f * 4, v)
+            for f, v in enumerate(map(record.get, self.fields))
+            if v is not None and v == v
+        ]
+        with self.lock:
+            row = self.rows.get(station)
+            if row is None:
+                row = self._row(station)
+            epochs, stats, increases = self.epochs, self.stats, self.increases
+
+            # counter increments since the previous sample, like Prometheus increase()
+            incs = []
+            for c, v in enumerate(map(record.get, self.counters)):
+                if v is None or v != v:
+                    continue
+                last = self.last[row * C + c]
+                self.last[row * C + c] = v
+                if last == last:
+                    incs.append((c, v - last if v >= last else v))
+
+            slot = row * self.slots
+            for width in self.widths:
+                epoch = int(t // width)
+                i = slot + epoch % B
+                slot += B
+                if epochs[i] != epoch:
+                    # the bucket is reused for a new interval
+                    epochs[i] = epoch
+                    stats[i * F4 : i * F4 + F4] = self.empty
+                    increases[i * C : i * C + C] = self.nothing
+                for f, v in values:
+                    j = i * F4 + f
+                    if v < stats[j]:
+                        stats[j] = v
+                    if v > stats[j + 1]:
+                        stats[j + 1] = v
+                    stats[j + 2] += v
+                    stats[j + 3] += 1
+                for c, v in incs:
+                    increases[i * C + c] += v
+
+    def drop(self, station: str) -> None:
+        """Forget a station, e.g. when it is evicted from the published telemetry"""
+        with self.lock:
+            row = self.rows.pop(station, None)
+            if row is not None:
+                self.free.append(row)
+
+    def collect(self, now: float | None = None):
+        """Build the aggregate gauges of every station, buckets outside the windows are ignored"""
+        now = time.time() if now is None else now
+        F = len(self.fields)
+        C = len(self.counters)
+        B = self.buckets
+        W = len(self.windows)
+        current = np.array([int(now // width) for width in self.widths])[:, None]
+        with self.lock:
+            rows = list(self.rows.items())
+            N = len(self.epochs) // self.slots
+            epochs = np.array(self.epochs).reshape(N, W, B)
+            stats = np.array(self.stats).reshape(N, W, B, F, 4)
+            increases = np.array(self.increases).reshape(N, W, B, C)
+
+        # (station, window, bucket) -> bucket within the window
+        valid = (epochs > current - B) & (epochs <= current)
+        mask = valid[..., None]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            lo = np.where(mask, stats[..., 0], np.inf).min(axis=2).tolist()
+            hi = np.where(mask, stats[..., 1], -np.inf).max(axis=2).tolist()
+            total = np.where(mask, stats[..., 2], 0.0).sum(axis=2)
+            n = np.where(mask, stats[..., 3], 0.0).sum(axis=2)
+            mean = (total / n).tolist()
+            inc = np.where(mask, increases, 0.0).sum(axis=2).tolist()
+        n = n.tolist()
+        seen = valid.any(axis=2).tolist()
+
+        families = {}
+        for k in self.fields:
+            desc = self.descs.get(k, k)
+            for agg in ["min", "max", "mean"]:
+                families[k, agg] = GaugeMetricFamily(
+                    f"{k}_{agg}",
+                    f"{desc} {agg} over the window",
+                    labels=["station", "window"],
+                )
+        for k in self.counters:
+            families[k, "increase"] = GaugeMetricFamily(
+                f"{k}_increase",
+                f"{self.descs.get(k, k)} increase over the window",
+                labels=["station", "window"],
+            )
+
+        for station, r in rows:
+            for w, window in enumerate(self.windows):
+                if not seen[r][w]:
+                    continue
+                labels = [station, window]
+                for f, k in enumerate(self.fields):
+                    if n[r][w][f]:
+                        families[k, "min"].add_metric(labels, lo[r][w][f])
+                        families[k, "max"].add_metric(labels, hi[r][w][f])
+                        families[k, "mean"].add_metric(labels, mean[r][w][f])
+                for c, k in enumerate(self.counters):
+                    families[k, "increase"].add_metric(labels, inc[r][w][c])
+        return list(families.values())
@@ -0,0 +1,168 @@
+"""
+Compact binary telemetry log for the PWS client
+An alternative to the JSON lines of pws.txt - a header describing the field layout followed by
+fixed-size records, so the log is about 5x smaller and can be read back as NumPy columns
+straight from a memory map without parsing or copying.
+
+    header  - magic b"PWSBIN01", little-endian u32 length of the JSON layout, the JSON layout
+              {"fields": [...], "dtype": "<f4"} padded with spaces to a multiple of 8 bytes
+    record  - ts (<f8, dateutc as Unix time), station (<u4), one value per field (dtype, NaN
+              if missing)
+
+Station names are appended to a side file (pws.bin.stations), one per line, the station id of
+a record is its line number.
+
+    BinaryLogSink - BatchWriter sink appending records
+    BinaryLog     - memory-mapped reader
+"""
+
+import json
+import math
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from store import parse_dateutc
+from writer import FSYNC_POLICIES
+
+MAGIC: bytes = b"PWSBIN01"
+
+
+def record_dtype(fields: list[str], dtype: str = "<f4") -> np.dtype:
+    """Structured dtype of a record, packed without padding"""
+    return np.dtype([("ts", "<f8"), ("station", "<u4"), *((k, dtype) for k in fields)])
+
+
+def read_stations(path: str) -> list[str]:
+    """Station names of a binary log, the index is the station id"""
+    try:
+        with open(path + ".stations", encoding="utf-8") as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+class BinaryLogSink:
+    """Append telemetry records to a binary log, the counterpart of writer.JSONLogSink.
+    Values are stored as float32 by default, about 7 significant digits."""
+
+    def __init__(
+        self, path: str, fields: list[str], fsync: str = "never", dtype: str = "<f4"
+    ) -> None:
+        """
+        Args:
+            path (str): binary log file, created with the header if it does not exist
+            fields (list[str]): telemetry fields stored in each record
+            fsync (str): fsync policy, see writer.JSONLogSink
+            dtype (str): NumPy dtype of the values, "<f4" or "<f8"
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync}")
+        self.path = path
+        self.fsync = fsync
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # keep the layout of the existing log, minus a record cut short by a crash
+            header = BinaryLog.header(path)
+            fields, dtype = header["fields"], header["dtype"]
+            size = record_dtype(fields, dtype).itemsize
+            records = (os.path.getsize(path) - header["offset"]) // size
+            os.truncate(path, header["offset"] + records * size)
+        else:
+            layout = json.dumps({"fields": fields, "dtype": dtype}).encode()
+            layout += b" " * (-(len(MAGIC) + 4 + len(layout)) % 8)
+            with open(path, "wb") as f:
+                f.write(MAGIC + struct.pack("<I", len(layout)) + layout)
+        self.fields = fields
+        self.dtype = record_dtype(fields, dtype)
+        self.stations = {k: i for i, k in enumerate(read_stations(path))}
+        self.f = open(path, "ab")
+        self.names = open(path + ".stations", "a", encoding="utf-8")
+
+    def station(self, name: str) -> int:
+        """Station id, new stations are appended to the side file first"""
+        sid = self.stations.get(name)
+        if sid is None:
+            sid = self.stations[name] = len(self.stations)
+            self.names.write(name.replace("\n", " ") + "\n")
+            self.names.flush()
+        return sid
+
+    def __call__(self, batch: list[dict]) -> None:
+        nan = math.nan
+        rows = [
+            (
+                parse_dateutc(r.get("dateutc")),
+                self.station(r.get("station", "")),
+                *(r.get(k, nan) for k in self.fields),
+            )
+            for r in batch
+        ]
+        self.f.write(np.array(rows, self.dtype).tobytes())
+        self.f.flush()
+        if self.fsync != "never":
+            os.fsync(self.f.fileno())
+
+    def close(self) -> None:
+        if self.fsync != "never":
+            os.fsync(self.names.fileno())
+            os.fsync(self.f.fileno())
+        self.names.close()
+        self.f.close()
+
+
+class BinaryLog:
+    """Memory-mapped reader of a binary log. records is a structured array over the map,
+    so each column is a strided view of the file and nothing is copied until it is used.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self.header(path)
+        self.fields: list[str] = header["fields"]
+        self.dtype = record_dtype(self.fields, header["dtype"])
+        offset = header["offset"]
+        # a record cut short by a crash is ignored
+        count = (len(self.map) - offset) // self.dtype.itemsize
+        self.records = np.frombuffer(self.map, self.dtype, count, offset)
+        self.stations: list[str] = read_stations(path)
+
+    @staticmethod
+    def header(path: str) -> dict:
+        """Field layout of a binary log, ValueError if the file is not one"""
+        with open(path, "rb") as f:
+            start = f.read(len(MAGIC) + 4)
+            if len(start) < len(MAGIC) + 4 or start[: len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a binary telemetry log")
+            (size,) = struct.unpack("<I", start[len(MAGIC) :])
+            header = json.loads(f.read(size))
+        header["offset"] = len(MAGIC) + 4 + size
+        return header
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def column(self, name: str) -> np.ndarray:
+        """Column of a field, "ts" or "station" as a view of the file"""
+        return self.records[name]
+
+    def station(self, name: str) -> np.ndarray:
+        """Records of a station, a copy"""
+        return self.records[self.records["station"] == self.stations.index(name)]
+
+    def close(self) -> None:
+        self.records = None
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # columns are still in use, the map is closed with the last of them
+        self.file.close()
+
+    def __enter__(self) -> "BinaryLog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,215 @@
+"""
+Protocol decoders for the PWS client
+Each upstream protocol compiles its field map, units and conversions once at startup and turns a
+request into the same normalised record - Ecowitt field names in the station's imperial units -
+which main.py localises and publishes. Requests are dispatched through a (method, path) table.
+
+    Ecowitt      - POST form data to /telemetry (or the Ecowitt default /data/report/)
+    Wunderground - GET query string to /weatherstation/updateweatherstation.php
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Mapping
+from urllib.parse import parse_qsl, unquote_plus
+
+from prometheus_client import Counter
+
+posts = Counter("pws_posts_total", "Telemetry requests received", ["protocol"])
+parse_failures = Counter(
+    "pws_parse_failures_total", "Telemetry values that are not numbers", ["field"]
+)
+missing_fields = Counter(
+    "pws_missing_fields_total", "Telemetry fields missing from a request", ["field"]
+)
+
+# Wunderground field -> Ecowitt field, the units are the same
+WUNDERGROUND_FIELDS: dict[str, str] = {
+    "dateutc": "dateutc",
+    "indoortempf": "tempinf",
+    "indoorhumidity": "humidityin",
+    "baromin": "baromrelin",
+    "absbaromin": "baromabsin",
+    "tempf": "tempf",
+    "humidity": "humidity",
+    "winddir": "winddir",
+    "windspeedmph": "windspeedmph",
+    "windgustmph": "windgustmph",
+    "solarradiation": "solarradiation",
+    "UV": "uv",
+    "rainin": "hourlyrainin",
+    "dailyrainin": "dailyrainin",
+    "weeklyrainin": "weeklyrainin",
+    "monthlyrainin": "monthlyrainin",
+    "yearlyrainin": "yearlyrainin",
+    "totalrainin": "totalrainin",
+}
+# fields of the map that only some Wunderground stations send, e.g. the indoor sensor
+# or the solar radiation, not counted in pws_missing_fields_total when absent
+WUNDERGROUND_OPTIONAL: frozenset[str] = frozenset(
+    {
+        "indoortempf",
+        "indoorhumidity",
+        "absbaromin",
+        "solarradiation",
+        "UV",
+        "weeklyrainin",
+        "monthlyrainin",
+        "yearlyrainin",
+        "totalrainin",
+    }
+)
+
+
+def utcdate(v: str) -> str:
+    """Wunderground sends dateutc=now when the station has no clock"""
+    if v == "now":
+        return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    return v
+
+
+class Decoder:
+    """Field map of an upstream protocol, compiled into a lookup table of raw field name
+    to (normalised field name, converter)"""
+
+    def __init__(
+        self,
+        name: str,
+        method: str,
+        paths: list[str],
+        fields: dict[str, tuple[str, Callable[[str], Any]]],
+        key: str,
+        fallback: list[str],
+        response: bytes = b"Ok read.",
+        optional: frozenset[str] = frozenset(),
+    ) -> None:
+        """
+        Args:
+            name (str): protocol name, the "protocol" label of pws_posts_total
+            method (str): HTTP method, POST reads the body and GET the query string
+            paths (list[str]): request paths of the protocol
+            fields (dict): raw field -> (normalised field, converter from the text value)
+            key (str): raw field identifying the station
+            fallback (list[str]): raw fields identifying the station if the key is missing
+            response (bytes): response body expected by the station
+            optional (frozenset[str]): normalised fields not counted when missing
+        """
+        self.name = name
+        self.method = method
+        self.paths = paths
+        self.fields = fields
+        self.key = key
+        self.fallback = fallback
+        self.response = response
+        self.posts = posts.labels(name)
+
+        # numbers are converted straight from the raw bytes, text is unquoted first
+        self.table: dict[bytes, tuple[str, Callable[[bytes], Any]]] = {
+            k.encode(): (
+                (n, float)
+                if c is float
+                else (n, lambda v, c=c: c(unquote_plus(v.decode())))
+            )
+            for k, (n, c) in fields.items()
+        }
+        self.identity: set[bytes] = {key.encode(), *(f.encode() for f in fallback)}
+        self.required: frozenset[str] = frozenset(
+            n for n, _ in fields.values() if n not in optional
+        )
+
+    def station(self, ident: Mapping[str, str]) -> str:
+        """Station identity used as the "station" label"""
+        key = ident.get(self.key)
+        if key:
+            return key
+        return "/".join(ident.get(f, "unknown") for f in self.fallback)
+
+    def decode(self, raw: bytes) -> tuple[str, dict]:
+        """Decode an urlencoded body or query string in one pass over the table.
+        A malformed value falls back to decode_form, which skips it.
+
+        Args:
+            raw (bytes): urlencoded telemetry
+
+        Returns:
+            tuple[str, dict]: station identity and normalised record
+        """
+        table = self.table
+        identity = self.identity
+        record: dict = {}
+        ident: dict = {}
+        try:
+            for pair in raw.split(b"&"):
+                k, _, v = pair.partition(b"=")
+                f = table.get(k)
+                if f is not None:
+                    record[f[0]] = f[1](v)
+                elif k in identity:
+                    ident[k.decode()] = unquote_plus(v.decode())
+        except ValueError:
+            return self.decode_form(dict(parse_qsl(raw.decode("utf-8", "replace"))))
+
+        if not self.required <= record.keys():
+            for n in self.required - record.keys():
+                missing_fields.labels(n).inc()
+        return self.station(ident), record
+
+    def decode_form(self, form: Mapping[str, str]) -> tuple[str, dict]:
+        """Decode already parsed form data or query arguments, skipping and counting
+        missing or invalid values
+
+        Args:
+            form (Mapping[str, str]): key-value pairs from the request
+
+        Returns:
+            tuple[str, dict]: station identity and normalised record
+        """
+        record: dict = {}
+        for k, (n, c) in self.fields.items():
+            v = form.get(k)
+            if v is None:
+                if n in self.required:
+                    missing_fields.labels(n).inc()
+                continue
+            try:
+                record[n] = c(v)
+            except ValueError:
+                parse_failures.labels(n).inc()
+        return self.station(form), record
+
+
+def build_decoders(
+    fields: list[str], optional: Iterable[str] = ()
+) -> dict[tuple[str, str], Decoder]:
+    """Compile the decoders of the supported protocols
+
+    Args:
+        fields (list[str]): normalised telemetry fields received from the stations
+        optional (Iterable[str]): fields only sent by stations with the sensor
+
+    Returns:
+        dict[tuple[str, str], Decoder]: dispatch table of (method, path) -> decoder
+    """
+    ecowitt = Decoder(
+        "ecowitt",
+        "POST",
+        ["/telemetry", "/data/report/"],
+        {k: (k, str if k == "dateutc" else float) for k in fields},
+        "PASSKEY",
+        ["stationtype", "model"],
+        optional=frozenset(optional),
+    )
+    wunderground = Decoder(
+        "wunderground",
+        "GET",
+        ["/weatherstation/updateweatherstation.php"],
+        {
+            k: (n, utcdate if n == "dateutc" else float)
+            for k, n in WUNDERGROUND_FIELDS.items()
+            if n in fields
+        },
+        "ID",
+        ["softwaretype"],
+        b"success\n",
+        frozenset(WUNDERGROUND_FIELDS[k] for k in WUNDERGROUND_OPTIONAL),
+    )
+    return {(d.method, p): d for d in [ecowitt, wunderground] for p in d.paths}
@@ -0,0 +1,169 @@
+"""
+Cached /metrics exposition for the PWS client
+The registry is only rendered again after new telemetry has been published, or once the
+rendered page is older than max_age so the counters and gauges of the client itself stay
+current. Every other scrape is served from the pre-rendered plain text and gzip compressed bytes.
+
+    ExpositionCache     - rendered metrics + WSGI app serving them
+    start_metrics_server - threaded HTTP server for the WSGI app, like prometheus_client's start_http_server
+"""
+
+import gzip
+import threading
+import time
+from socketserver import ThreadingMixIn
+from typing import Any, Callable
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+cache_requests = Counter(
+    "pws_exposition_cache_requests_total",
+    "Scrapes served from the cached exposition (hit) or after rendering it (miss)",
+    ["result"],
+)
+cache_hit_ratio = Gauge(
+    "pws_exposition_cache_hit_ratio", "Fraction of scrapes served from the cache"
+)
+render_time = Histogram(
+    "pws_exposition_render_seconds",
+    "Time taken to render and compress the exposition",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+class ExpositionCache:
+    """Rendered registry, rebuilt on the first scrape after invalidate() was called or
+    once it is max_age seconds old. refresh, if set, is called before every scrape and
+    may invalidate the cache itself e.g. to expire stale series."""
+
+    def __init__(
+        self,
+        registry: CollectorRegistry = REGISTRY,
+        refresh: Callable[[], Any] | None = None,
+        max_age: float = 10.0,
+    ) -> None:
+        self.registry = registry
+        self.refresh = refresh
+        self.max_age = max_age  # seconds, 0 renders on every scrape
+        self.generation: int = 0  # bumped by every publish
+        self.rendered: int = -1  # generation of the cached bytes
+        self.expires: float = 0.0  # monotonic time the cached bytes are too old
+        self.plain: bytes = b""
+        self.gzipped: bytes = b""
+        self.lock = threading.Lock()
+        self.hits = cache_requests.labels("hit")
+        self.misses = cache_requests.labels("miss")
+        self.hit_count: int = 0
+        self.miss_count: int = 0
+        cache_hit_ratio.set_function(self.hit_ratio)
+
+    def invalidate(self) -> None:
+        """Mark the cached exposition as stale, called when new telemetry is published"""
+        self.generation += 1
+
+    def hit(self) -> None:
+        self.hit_count += 1
+        self.hits.inc()
+
+    def hit_ratio(self) -> float:
+        total = self.hit_count + self.miss_count
+        return self.hit_count / total if total else 0.0
+
+    def fresh(self) -> bool:
+        return self.rendered == self.generation and time.monotonic() < self.expires
+
+    def get(self) -> tuple[bytes, bytes]:
+        """Current exposition, rendering it again if new telemetry was published
+        or the cached one is older than max_age
+
+        Returns:
+            tuple[bytes, bytes]: plain text and gzip compressed exposition
+        """
+        if self.refresh is not None:
+            self.refresh()
+        if self.fresh():
+            self.hit()
+            return self.plain, self.gzipped
+        with self.lock:
+            # another scrape may have rendered it while waiting for the lock
+            if self.fresh():
+                self.hit()
+                return self.plain, self.gzipped
+            self.miss_count += 1
+            self.misses.inc()
+            generation = self.generation
+            start = time.monotonic()
+            with render_time.time():
+                plain = generate_latest(self.registry)
+                gzipped = gzip.compress(plain, compresslevel=6)
+            self.plain, self.gzipped = plain, gzipped
+            self.rendered = generation
+            self.expires = start + self.max_age
+        return plain, gzipped
+
+    def wsgi_app(self, environ, start_response):
+        """WSGI app serving the cached exposition, gzip compressed if the scraper accepts it"""
+        if environ.get("PATH_INFO") == "/favicon.ico":
+            start_response("200 OK", [])
+            return [b""]
+
+        params = parse_qs(environ.get("QUERY_STRING", ""))
+        if "name[]" in params:
+            # filtered scrapes are rare and rendered as is
+            output = generate_latest(
+                self.registry.restricted_registry(params["name[]"])
+            )
+            headers = [("Content-Type", CONTENT_TYPE_LATEST)]
+        else:
+            plain, gzipped = self.get()
+            if "gzip" in environ.get("HTTP_ACCEPT_ENCODING", ""):
+                output = gzipped
+                headers = [
+                    ("Content-Type", CONTENT_TYPE_LATEST),
+                    ("Content-Encoding", "gzip"),
+                ]
+            else:
+                output = plain
+                headers = [("Content-Type", CONTENT_TYPE_LATEST)]
+        headers.append(("Content-Length", str(len(output))))
+        start_response("200 OK", headers)
+        return [output]
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """Thread per request HTTP server"""
+
+    daemon_threads = True
+
+
+class SilentHandler(WSGIRequestHandler):
+    """WSGI handler that does not log requests"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, addr: str, app) -> None:
+    """Serve the metrics WSGI app from a daemon thread
+
+    Args:
+        port (int): listening port
+        addr (str): listening address
+        app: WSGI app e.g. ExpositionCache.wsgi_app
+    """
+    httpd = make_server(
+        addr, port, app, ThreadingWSGIServer, handler_class=SilentHandler
+    )
+    t = threading.Thread(target=httpd.serve_forever)
+    t.daemon = True
+    t.start()
@@ -0,0 +1,192 @@
+"""
+Recent telemetry history for the PWS client
+Every station has a fixed-size ring of samples in a NumPy array, one column per history field
+plus the ingest time, filled straight from the array published for the scrape (see main.publish).
+The rings are allocated on first use and their total size is capped, the least recently heard
+station loses its history first.
+
+Slices are formatted as CSV or JSON without creating a Python object per sample - the numbers
+are scaled to integers and written as digits into a NUL padded byte matrix, which is joined and
+stripped in one go.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+POWERS = 10 ** np.arange(19, dtype=np.int64)[::-1]  # 10^18 .. 10^0, the int64 digits
+
+
+def format_numbers(column: np.ndarray, decimals: int, missing: bytes) -> np.ndarray:
+    """Format a column of numbers as ASCII, rounded to a number of decimals without trailing zeros
+
+    Args:
+        column (np.ndarray): float64 values
+        decimals (int): number of decimals, 0 to 6
+        missing (bytes): text of NaN and infinite values e.g. b"null"
+
+    Returns:
+        np.ndarray: uint8 matrix, one NUL padded row of text per value
+    """
+    finite = np.isfinite(column)
+    scaled = np.rint(np.where(finite, column, 0.0) * 10.0**decimals)
+    if np.abs(scaled).max(initial=0.0) >= 9e18:
+        # too large for int64, fall back to Python's repr
+        text = np.array(
+            [repr(round(v, decimals)).encode() for v in column.tolist()], "S32"
+        )
+        text[~finite] = missing
+        return text.view(np.uint8).reshape(len(column), -1)
+
+    n = len(column)
+    value = np.abs(scaled).astype(np.int64)[:, None]
+    # only as many digit columns as the largest value needs
+    width = max(len(str(int(value.max(initial=0)))), decimals + 1)
+    powers = POWERS[-width:]
+    digits = (value // powers) % 10  # (n, width), most significant first
+    integer = width - decimals  # digit columns of the integer part
+    shown = np.empty((n, width), bool)
+    # integer part without leading zeros, fraction without trailing zeros
+    shown[:, :integer] = value >= powers[:integer]
+    shown[:, integer - 1] = True
+    shown[:, integer:] = value % (powers[integer:] * 10) != 0
+    out = np.zeros((n, width + 2), np.uint8)  # sign, integer digits, point, fraction
+    out[:, 0] = np.where(scaled < 0, ord("-"), 0)
+    body = np.where(shown, digits + ord("0"), 0).astype(np.uint8)
+    out[:, 1 : integer + 1] = body[:, :integer]
+    out[:, integer + 1] = np.where(value[:, 0] % 10**decimals != 0, ord("."), 0)
+    out[:, integer + 2 :] = body[:, integer:]
+
+    if not finite.all():
+        out[~finite] = 0
+        out[~finite, : len(missing)] = np.frombuffer(missing, np.uint8)
+    return out
+
+
+def join(columns: list[np.ndarray], sep: bytes, end: bytes) -> bytes:
+    """Join formatted columns into text, sep between the values of a row and end after each row
+
+    Args:
+        columns (list[np.ndarray]): uint8 matrices from format_numbers, same number of rows
+        sep (bytes): single byte separator
+        end (bytes): single byte row terminator
+
+    Returns:
+        bytes: the text with the NUL padding removed
+    """
+    n = len(columns[0])
+    parts = []
+    for i, c in enumerate(columns):
+        parts.append(c)
+        parts.append(
+            np.full((n, 1), ord(end if i == len(columns) - 1 else sep), np.uint8)
+        )
+    return np.concatenate(parts, axis=1).tobytes().replace(b"\0", b"")
+
+
+class HistoryBuffer:
+    """Ring of recent samples per station, the rings are capped in number by max_bytes"""
+
+    def __init__(
+        self, fields: list[str], columns: list[int], capacity: int, max_bytes: int
+    ) -> None:
+        """
+        Args:
+            fields (list[str]): history fields
+            columns (list[int]): index of each field in the published array
+            capacity (int): samples kept per station
+            max_bytes (int): upper bound on the memory of all the rings
+        """
+        if capacity < 1:
+            raise ValueError("The history keeps at least one sample per station")
+        self.fields = fields
+        self.index = {k: i for i, k in enumerate(fields)}
+        # the ingest time is the last value of the published array
+        self.columns = np.array([*columns, -1], np.intp)
+        self.capacity = capacity
+        self.max_stations = max(1, max_bytes // (capacity * len(self.columns) * 8))
+        # station -> [samples, number of samples added]
+        self.rings: OrderedDict[str, list] = OrderedDict()
+        self.lock = threading.Lock()  # guards the rings against concurrent requests
+
+    def add(self, station: str, values) -> None:
+        """Append a published array of a station to its ring
+
+        Args:
+            station (str): station identity
+            values: float64 array of the published telemetry, ingest time last
+        """
+        row = np.frombuffer(values, np.float64)[self.columns]
+        with self.lock:
+            ring = self.rings.get(station)
+            if ring is None:
+                if len(self.rings) >= self.max_stations:
+                    self.rings.popitem(last=False)
+                ring = self.rings[station] = [
+                    np.empty((self.capacity, len(self.columns))),
+                    0,
+                ]
+            else:
+                self.rings.move_to_end(station)
+            ring[0][ring[1] % self.capacity] = row
+            ring[1] += 1
+
+    def drop(self, station: str) -> None:
+        """Forget the history of a station"""
+        with self.lock:
+            self.rings.pop(station, None)
+
+    def slice(self, station: str, fields: list[str], since: float) -> np.ndarray:
+        """Samples of a station received after a time, oldest first
+
+        Args:
+            station (str): station identity
+            fields (list[str]): history fields, KeyError if one is not kept
+            since (float): Unix time
+
+        Returns:
+            np.ndarray: (samples, 1 + fields) copy, the ingest time first
+        """
+        cols = [-1, *(self.index[k] for k in fields)]
+        with self.lock:
+            ring = self.rings.get(station)
+            if ring is None:
+                return np.empty((0, len(cols)))
+            samples, count = ring
+            if count <= self.capacity:
+                ordered = samples[:count]
+            else:
+                head = count % self.capacity
+                ordered = np.concatenate([samples[head:], samples[:head]])
+            start = np.searchsorted(ordered[:, -1], since, side="right")
+            return ordered[start:, cols]
+
+    def csv(
+        self, station: str, fields: list[str], since: float, decimals: int
+    ) -> bytes:
+        """History as CSV with a time column and a column per field"""
+        data = self.slice(station, fields, since)
+        header = ",".join(["time", *fields]).encode() + b"\n"
+        if not len(data):
+            return header
+        columns = [format_numbers(data[:, 0], 3, b"")]
+        columns += [
+            format_numbers(data[:, i], decimals, b"") for i in range(1, data.shape[1])
+        ]
+        return header + join(columns, b",", b"\n")
+
+    def json(
+        self, station: str, fields: list[str], since: float, decimals: int
+    ) -> bytes:
+        """History as a JSON object of the station, the time array and an array per field"""
+        data = self.slice(station, fields, since)
+        parts = [b'{"station":' + json.dumps(station).encode()]
+        for i, k in enumerate(["time", *fields]):
+            values = b""
+            if len(data):
+                text = format_numbers(data[:, i], 3 if i == 0 else decimals, b"null")
+                values = join([text], b",", b",")[:-1]
+            parts.append(json.dumps(k).encode() + b":[" + values + b"]")
+        return b",".join(parts) + b"}"
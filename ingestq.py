@@ -0,0 +1,107 @@
+"""
+Asynchronous ingest queue for the PWS client
+With --async_ingest the request handlers only decode and validate the telemetry, queue it and
+answer the station straight away. A pool of worker greenlets on the same gevent loop does the
+conversion, the calculations, the logging and the publication.
+
+The queue is bounded, when it is full the overflow policy either drops the oldest queued record
+(drop_oldest) or turns the new request away with a 503 (reject) so the station sends it again.
+"""
+
+import time
+from typing import Callable
+
+import gevent
+from gevent.queue import Empty, Full, JoinableQueue
+from prometheus_client import Counter, Gauge, Histogram
+
+OVERFLOW_POLICIES: list[str] = ["drop_oldest", "reject"]
+
+queue_depth = Gauge(
+    "pws_ingest_queue_depth", "Telemetry records waiting to be ingested"
+)
+queue_lag = Histogram(
+    "pws_ingest_queue_lag_seconds",
+    "Time a telemetry record waited in the ingest queue",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+queue_overflow = Counter(
+    "pws_ingest_queue_overflow_total",
+    "Telemetry records dropped or rejected because the ingest queue was full",
+    ["policy"],
+)
+
+
+class IngestQueue:
+    """Bounded queue of (station, record) drained by a pool of worker greenlets"""
+
+    def __init__(
+        self,
+        handler: Callable[[str, dict], bool],
+        workers: int = 4,
+        maxsize: int = 10000,
+        overflow: str = "drop_oldest",
+    ) -> None:
+        """
+        Args:
+            handler (Callable): called by the workers with the station and the record
+            workers (int): number of worker greenlets
+            maxsize (int): maximum number of queued records
+            overflow (str): drop_oldest or reject when the queue is full
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}")
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.overflow = overflow
+        self.queue: JoinableQueue = JoinableQueue(maxsize)
+        self.pool: list[gevent.Greenlet] = []
+        self.overflows = queue_overflow.labels(overflow)
+        queue_depth.set_function(self.queue.qsize)
+
+    def start(self) -> "IngestQueue":
+        self.pool = [gevent.spawn(self.run) for _ in range(self.workers)]
+        return self
+
+    def put(self, station: str, record: dict) -> bool:
+        """Queue the telemetry of a station without blocking
+
+        Args:
+            station (str): station identity
+            record (dict): decoded telemetry
+
+        Returns:
+            bool: False if the queue was full and the record rejected
+        """
+        item = (time.perf_counter(), station, record)
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except Full:
+            self.overflows.inc()
+            if self.overflow == "reject":
+                return False
+        # drop_oldest - make room for the newest reading
+        try:
+            self.queue.get_nowait()
+            self.queue.task_done()
+        except Empty:
+            pass
+        self.queue.put_nowait(item)
+        return True
+
+    def run(self) -> None:
+        while True:
+            queued, station, record = self.queue.get()
+            try:
+                queue_lag.observe(time.perf_counter() - queued)
+                self.handler(station, record)
+            except Exception as e:
+                print(f"ingest worker failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Ingest the queued records and stop the workers"""
+        self.queue.join(timeout)
+        gevent.killall(self.pool)
@@ -4,7 +4,7 @@ The weather station data is based on the Tesa WS-2980c PRO personal weather stat
 This uses the EasyWeatherPro firmware found in many other PWS's (Ambient Weather, Ecowitt and other Fine Offset clones)
 
     Port 1111 is open for incoming telemetry from the Weather station - 30-60sec update cycle
-    Port 8080 is open for scrape requests from Prometheus - 30sec update loop
+    Port 8080 is open for scrape requests from Prometheus - metrics built at scrape time
     Stop this Prometheus Exporter client
     Metrics being sent to the Prometheus server uses Ecowitt or wundergraound format
     Currently using the Ecowitt data format - examples at the end of the file
@@ -14,231 +14,107 @@ This uses the EasyWeatherPro firmware found in many other PWS's (Ambient Weather
 """
 
 import argparse
-import json
-import math
 import os
+import signal
 import socket
 import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
 
-import gevent  # https://www.gevent.org/
-from flask import Flask, request, send_file
-from gevent.pywsgi import WSGIServer
+import gevent
+from flask import Flask, Response, request, send_file
+from gevent.pool import Pool  # https://www.gevent.org/
 
 # pip install prometheus_client
-from prometheus_client import Gauge, start_http_server
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+from aggregates import RollingAggregates, parse_windows
+from binlog import BinaryLogSink
+from decoders import Decoder, build_decoders
+from exposition import ExpositionCache, start_metrics_server
+from history import HistoryBuffer
+from ingestq import OVERFLOW_POLICIES, IngestQueue
+from remotewrite import RemoteWriteSink
+from schema import SCHEMA, Schema
+from segments import COMPRESSION, Compressor, SegmentedLogSink
+from serving import make_server, mount
+from store import TelemetryStore, parse_dateutc
+from writer import FSYNC_POLICIES, BatchWriter, JSONLogSink
 
 # Weather station reciever Flask app
 app = Flask("Weather")
 
-PWSdata: dict = {}  # Incoming data from the PWS
-isReady: bool = False  # make sure data has been read
+stations: OrderedDict[str, array] = OrderedDict()  # latest telemetry per station
+stations_lock = threading.Lock()  # guards stations against the scrape thread
+max_stations: int = 1000  # upper bound on the number of tracked stations
+station_ttl: float = 0  # seconds a quiet station is kept, 0 keeps it until evicted
 pws_port: int = 1111  # personal weather station lsitening port
 prom_port: int = 8080  # Prometheus scraping port
 data_fld: str = ".\\"  # folder for the local data file
 
-# for i, v in enumerate(list):
-# for k, v in dict.items()
-pwsvar: list[str] = [
-    "dateutc",
-    "tempinf",
-    "humidityin",
-    "baromrelin",
-    "baromabsin",
-    "tempf",
-    "humidity",
-    "winddir",
-    "windspeedmph",
-    "windgustmph",
-    "maxdailygust",
-    "solarradiation",
-    "uv",
-    "rainratein",
-    "eventrainin",
-    "hourlyrainin",
-    "dailyrainin",
-    "weeklyrainin",
-    "monthlyrainin",
-    "yearlyrainin",
-    "totalrainin",
-    "dewpt",
-    "chillpt",
-    "frostpt",
-    "feelslike",
-]
+# the telemetry fields, their units and the calculated fields are declared in schema.py
+schema = Schema(SCHEMA)
+pwsvar: list[str] = schema.names
+pwsdesc: list[str] = schema.descs
+calculated: list[str] = schema.calculated  # not POSTed
 
-pwsdesc: list[str] = [
-    "Timestamp",
-    "Indoor temperature °C",
-    "Indoor humidity %",
-    "Barometric pressure hPa (relative)",
-    "Barometric pressure hPa (absolute)",
-    "Outdoor temperature °C",
-    "Outdoor humidity %",
-    "Wind direction °",
-    "Windspeed Km/h",
-    "Windsgust Km/h",
-    "Max daily wind gust Km/h",
-    "Solar Radiation w/m^2",
-    "UV index",
-    "Last 10 minutes rainfall multiplication 6",
-    "Event rain per hour ml/Hr",
-    "Rain per hour ml/Hr",
-    "Rain per day in ml",
-    "Rain per week in ml",
-    "Rain per month in ml",
-    "Rain per year in L",
-    "Total rain since power on in L",
-    "Dew point temperature in  °C",
-    "Wind chill index °C",
-    "Frost point temperature in °C",
-    'Metservice "Feels Like" °C',
-]
+# (method, path) -> protocol decoder of the incoming telemetry
+decoders: dict[tuple[str, str], Decoder] = build_decoders(
+    schema.received, schema.optional
+)
+
+aggregates: RollingAggregates  # rolling min/max/mean per station, see __main__
 
-gauges: dict[str, Gauge] = {}
+# last samples of each station for /history, the fields every station sends
+history_fields: list[str] = [
+    k for k in pwsvar if k != "dateutc" and k not in schema.optional
+]
+history: HistoryBuffer  # built in __main__ with the --history sizes
+
+ingest_queue: IngestQueue | None = None  # --async_ingest, records acked before ingest
+log_writer: BatchWriter  # background writer for pws.txt, see __main__
+store_writer: BatchWriter | None = None  # optional SQLite writer
+remote_writer: BatchWriter | None = None  # optional Prometheus remote-write push
+exposition = ExpositionCache()  # rendered /metrics, rebuilt after each publish
+
+# self-instrumentation of the ingest pipeline
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+request_time = Histogram(
+    "pws_request_seconds", "Telemetry POST handling time", buckets=LATENCY_BUCKETS
+)
+localise_time = Histogram(
+    "pws_localise_seconds", "LocaliseData conversion time", buckets=LATENCY_BUCKETS
+)
+log_time = Histogram(
+    "pws_log_queue_seconds",
+    "Time taken to queue a record for the writers, see pws_writer_write_seconds",
+    buckets=LATENCY_BUCKETS,
+)
+dropped_records = Counter(
+    "pws_dropped_records_total", "Telemetry records not published", ["reason"]
+)
+expired_stations = Counter(
+    "pws_expired_stations_total", "Stations removed after no telemetry for --ttl"
+)
 
 # ======================
 # Utility functions
 
 
 def log(response: dict) -> None:
-    global data_fld
-
-    """Log the JSON encoded telemetry to a text file
+    """Queue the telemetry for the background writers, which append it in batches
+        to the pws.txt text file as JSON and to the SQLite database if enabled
 
     Args:
         response (dict): key-value pairs from the POST request
     """
-    try:
-        f = open(f"{data_fld}\\pws.txt", "a")
-        # data = str(response)
-        data = json.dumps(response)
-        f.write(f"{data}\n")
-        f.flush()
-    finally:
-        f.close()
-
-
-def FtoC(T: float) -> float:
-    """Convert Fahrenheit to Celsius
-
-    Args:
-        T (float): Temperature value in Fahrenheit
-
-    Returns:
-        float: Temperature value in Celsius
-    """
-    return round((T - 32) / 1.8, 1) if T is not None else 0
-
-
-def CtoF(T: float) -> float:
-    """Convert Fahrenheit to Celsius
-
-    Args:
-        T (float): Temperature value in Fahrenheit
-
-    Returns:
-        float: Temperature value in Celsius
-    """
-    return round((T * 1.8) + 32, 1) if T is not None else 0
-
-
-def WindChillIndex(T: float, W: float) -> float:
-    """Wind chill index/factor as based on the formula from
-        https://en.wikipedia.org/wiki/Wind_chill
-    Args:
-        T (float): Temperature in Celsius
-        W (float): Wind speed in Km/H
-
-    Returns:
-        float: wind chill index/factor
-    """
-    # Only for Temp < 10 °C and wind > 5Km/h
-    if T < 10 or W < 5:
-        return 0
-    return round(
-        13.112
-        + (0.6215 * T)
-        - 11.37 * math.pow(W, 0.16)
-        + 0.3965 * T * math.pow(W, 0.16),
-        0,
-    )
-
-
-def Frostpoint(T: float, Ts: float) -> float:  # in °C
-    """Calculates the frost point temperature as per the formulae and constants in
-        https://docs.vaisala.com/r/M211280EN-D/en-US/GUID-10D5B48D-8D47-40AF-9F4F-953C3C05CE13/GUID-060D9333-9043-49F3-9575-1C2AF978BBF9
-
-    Args:
-        T (float): Temperature in Celsius
-        Ts (float):  Dew Point temperature in Celsius
-
-    Returns:
-        float: frost point temperature in Celsius
-    """
-    Ts_K = 273.15 + Ts
-    T_K = 273.15 + T
-    frostpoint_k = (
-        Ts_K - T_K + 2671.02 / ((2954.61 / T_K) + 2.193665 * math.log(T_K) - 13.3448)
-    )
-    return round(frostpoint_k - 273.15, 1)
-
-
-def Dewpoint(T: float, RH: float) -> float:  # in °C
-    """Dew point as calculated in https://en.wikipedia.org/wiki/Dew_point
-        Specifically the a & b constants from 1974 Psychrometry and Psychrometric Charts.
-    Args:
-        T (float): Temperature in Celsius
-        RH (float): Relative humidity as %
-
-    Returns:
-        float: dew Point temperature in Celsius
-    """
-    A = 17.27
-    B = 237.7
-    alpha = ((A * T) / (B + T)) + math.log(RH / 100.0)
-    return round((B * alpha) / (A - alpha), 1)
-
-
-def FeelsLike(T: float, W: float, RH: float) -> float:
-    """A feels like temperature value as per https://blog.metservice.com/FeelsLikeTemp
-        This function combines three formula to produce one of four temperatures
-        - Feels like temperature
-        - Apparent temperature
-        - Metservice rollover temperature
-        - Actual measured temperature
-
-    Args:
-        T (float): Temperature in Celsius
-        W (float): Wind speed in Km/H
-        RH (float): Relative humidity as %
-
-    Returns:
-        float: Feels like temperature
-    """
-    # Dew point calculation - see above for details
-    alpha = ((17.27 * T) / (237.7 + T)) + math.log(RH / 100.0)
-    DP = (237.7 * alpha) / (17.27 - alpha)
-
-    # Apparent temperature calculation
-    Wms = (W * 1000) / 3600  # Km/h -> m/s
-    AT = T + 0.33 * DP - 0.7 * Wms - 4.0
-
-    # Windchill index
-    WC = (
-        13.112
-        + (0.6215 * T)
-        - 11.37 * math.pow(W, 0.16)
-        + 0.3965 * T * math.pow(W, 0.16)
-    )
-    # Windchill
-    if T < 10 and W > 4:
-        return WC
-
-    # Metservice rollover
-    if T > 11 and T < 15:
-        return T - ((T - DP) * (14 - T) / 4)
-    # Max of Apparent or Measured Temp
-    return max(T, AT)
+    with log_time.time():
+        log_writer.put(response)
+        if store_writer is not None:
+            store_writer.put(response)
 
 
 # convert temperatures, distances, pressures and other calculations to local units
@@ -252,34 +128,9 @@ def LocaliseData(PWSdata: dict) -> dict:
     Returns:
         dict: Converted and calculaetd telemetry
     """
-    # fix temperatures F to C
-    # Celcius = (Fahrenheit - 32) / 1.8
-    # Fahrenheit = (Celsius * 1.8) + 32
-    PWSdata["tempinf"] = FtoC(PWSdata["tempinf"])
-    PWSdata["tempf"] = FtoC(PWSdata["tempf"])
-
-    # 1 hPa = 0.029529983071445 inHg
-    # 1 inch of mercury = ±33.86 millibars or hPa.
-    # sealevel is ±29.29inHg or 1013mb @ 1000feet or 305m
-    # The air pressure at sea level is 1018 hPa (QNH)
-    PWSdata["baromrelin"] = round(PWSdata["baromrelin"] / 0.029529983071445, 1)
-    PWSdata["baromabsin"] = round(PWSdata["baromabsin"] / 0.029529983071445, 1)
-
-    # convert miles to km
-    # 1mile = 1.609344Km
-    PWSdata["windspeedmph"] = round(PWSdata["windspeedmph"] * 1.609344, 1)
-    PWSdata["windgustmph"] = round(PWSdata["windgustmph"] * 1.609344, 1)
-    PWSdata["maxdailygust"] = round(PWSdata["maxdailygust"] * 1.609344, 1)
-
-    # Calculate a couple of additonal metrics AFTER the above unit conversions
-    PWSdata["dewpt"] = Dewpoint(PWSdata["tempf"], PWSdata["humidity"])
-    PWSdata["frostpt"] = Frostpoint(PWSdata["tempf"], PWSdata["dewpt"])
-    PWSdata["chillpt"] = WindChillIndex(PWSdata["tempf"], PWSdata["windspeedmph"])
-    PWSdata["feelslike"] = FeelsLike(
-        PWSdata["tempf"], PWSdata["windspeedmph"], PWSdata["humidity"]
-    )
-
-    return PWSdata
+    # not every protocol sends every field, e.g. Wunderground has no maxdailygust
+    # the calculations need the temperature, humidity and wind speed - KeyError if missing
+    return schema.localise(PWSdata)
 
 
 @app.route("/favicon.ico")
@@ -296,7 +147,7 @@ def index():
            This uses the EasyWeatherPro firmware found in many other PWS's (Ambient Weather, Ecowitt and other Fine Offset clones)
          <ul>
          <li>Port 1111 is open for incoming telemetry from the Weather station - 60sec send cycle</li>
-         <li>Port 8080 is open for scrape requests from <a href="https://prometheus.io/">Prometheus</a> - 30sec update loop
+         <li>Port 8080 is open for scrape requests from <a href="https://prometheus.io/">Prometheus</a> - metrics built at scrape time
          <li><a href="/stop">Stop</a> this Prometheus Exporter client</a>
          <li><a href="http://localhost:8080/metrics" target="_blank" rel="noopener noreferrer"  >Metrics</a> being sent to the Prometheus server</a>
          </ul>
@@ -310,68 +161,246 @@ def PWSstop():
     sys.exit()
 
 
+def publish(station: str, PWSdata: dict) -> None:
+    """Publish the converted telemetry of a station for the next scrape.
+        Each station keeps a single flat array of floats in pwsvar order, NaN for the
+        fields it does not send, followed by the ingest time. The array is replaced,
+        never modified, so a scrape always sees a complete record.
+        The least recently heard station is dropped once max_stations is reached,
+        and the stations quiet for longer than station_ttl are expired.
+        The rolling aggregates and the history of the station are updated with the
+        same telemetry, and it is queued for the remote-write push if enabled.
+
+    Args:
+        station (str): station identity
+        PWSdata (dict): converted and calculated telemetry
+    """
+    now = time.time()
+    values = schema.row(PWSdata)
+    values[schema.index["dateutc"]] = parse_dateutc(PWSdata.get("dateutc"))
+    values.append(now)
+    with stations_lock:
+        stations[station] = values
+        stations.move_to_end(station)
+        while len(stations) > max_stations:
+            evicted = stations.popitem(last=False)[0]
+            aggregates.drop(evicted)
+            history.drop(evicted)
+    expire(now)
+    aggregates.update(station, PWSdata, now)
+    history.add(station, values)
+    if remote_writer is not None:
+        remote_writer.put((station, now, values))
+    exposition.invalidate()
+
+
+def expire(now: float | None = None) -> int:
+    """Remove the stations which sent no telemetry for station_ttl seconds, with their
+        gauges, rolling aggregates and history. stations is kept in the order the stations
+        were last heard, so only the expired ones at the front are looked at.
+
+    Args:
+        now (float, optional): current Unix time
+
+    Returns:
+        int: number of stations expired
+    """
+    if station_ttl <= 0:
+        return 0
+    cutoff = (time.time() if now is None else now) - station_ttl
+    expired = []
+    with stations_lock:
+        while stations and next(iter(stations.values()))[-1] < cutoff:
+            station = stations.popitem(last=False)[0]
+            aggregates.drop(station)
+            history.drop(station)
+            expired.append(station)
+    if expired:
+        expired_stations.inc(len(expired))
+        exposition.invalidate()
+    return len(expired)
+
+
+def ingest(station: str, PWSdata: dict) -> bool:
+    """Convert, log and publish the telemetry of a station
+
+    Args:
+        station (str): station identity
+        PWSdata (dict): POST data as floats except for the dateutc (string)
+
+    Returns:
+        bool: False if the telemetry could not be converted and was dropped
+    """
+    try:
+        with localise_time.time():
+            PWSdata = LocaliseData(PWSdata)  # data fixups
+    except (KeyError, TypeError, ValueError):
+        # a field needed for the calculations is missing or out of range
+        dropped_records.labels("invalid").inc()
+        exposition.invalidate()  # the drop is not published, serve the counter
+        return False
+    log({"station": station, **PWSdata})
+    publish(station, PWSdata)
+    return True
+
+
+def accept(station: str, PWSdata: dict) -> int:
+    """Ingest the telemetry of a station, or with the ingest queue only check it holds
+        the fields needed for the calculations and queue it
+
+    Args:
+        station (str): station identity
+        PWSdata (dict): POST data as floats except for the dateutc (string)
+
+    Returns:
+        int: HTTP status - 200, 400 for invalid telemetry or 503 if the queue is full
+    """
+    if ingest_queue is None:
+        return 200 if ingest(station, PWSdata) else 400
+    if not schema.inputs <= PWSdata.keys():
+        dropped_records.labels("invalid").inc()
+        return 400
+    return 200 if ingest_queue.put(station, PWSdata) else 503
+
+
 @app.route("/telemetry", methods=["GET", "POST"])
-def posted() -> str:
-    """The main weather station GET/POST handler for incoming telemety.
-        The POST data is added to a staging list for further processing
+@app.route("/data/report/", methods=["POST"])
+def posted():
+    """The main weather station GET/POST handler for incoming Ecowitt telemety.
+        The POST data is converted and published for the station that sent it
 
     Returns:
         str: simple response text after the GET or POST has been handled
     """
-    global PWSdata, pwsvar, isReady
-
-    # transfer the weather station POST data to the staging list - PWSdata
     if request.method == "POST":
-        PWSdata.clear()
-        for k in pwsvar:
-            try:
-                if k in [
-                    "dewpt",
-                    "chillpt",
-                    "frostpt",
-                    "feelslike",
-                ]:  # these are calculated and not in the POST data
-                    PWSdata[k] = 0
-                elif k == "dateutc":  # this is a string and not a gauge value
-                    PWSdata[k] = request.form[k]
-                else:
-                    PWSdata[k] = float(request.form[k])  # convert to float
-            except:
-                ValueError(f"Invalid telemetry value {request.form[k]}")
-        PWSdata = LocaliseData(PWSdata)  # data fixups
-        log(PWSdata)
-
-        isReady = True
-        return f"Ok read."
+        return received(decoders[("POST", request.path)], request.form)
     if request.method == "GET":
         return f"Weather Easy Weather Pro Prometheus Exporter."
     return f"Get request."
 
 
-def process_request() -> None:
-    """Main handler for the Promethus client - called once every 30 seconds to update the metrics"""
-    global pwsvar, PWSdata, isReady
-    # print(".", end="")
+@app.route("/weatherstation/updateweatherstation.php", methods=["GET"])
+def wunderground():
+    """Incoming telemetry in the Wunderground format, sent as a GET query string
 
-    # make sure there is some data
-    if not isReady:
-        return
+    Returns:
+        str: simple response text after the GET has been handled
+    """
+    return received(decoders[("GET", request.path)], request.args)
 
-    # iterate over the list of pws variables
-    for k in pwsvar:
-        # skip over the Timestamp, not a gauge variable
-        if k == "dateutc":
-            continue
 
-        v: float = PWSdata[k]
-        # now = datetime.strptime(PWSdata['dateutc'],"%Y-%m-%d %H:%M:%S") # e.g. '2024-06-03 01:02:17'
-        # gauges['dateutc'].labels(data="data", readable_datetime=now).set(float(time.time()))
-        try:
-            gauges[k].set(v)
-        except:
-            ValueError(f"Unable to set {k} with {v}")
+@app.route("/history", methods=["GET"])
+def recent():
+    """Recent telemetry of a station from the history buffer, as JSON or CSV
+        /history?station=<station>&field=tempf,humidity&since=<Unix time>&format=csv
+        All the history fields are returned if no field is given
+
+    Returns:
+        JSON or CSV response, the time column is the ingest time
+    """
+    station = request.args.get("station", "")
+    fields = request.args.get("field", ",".join(history.fields)).split(",")
+    try:
+        since = float(request.args.get("since", 0))
+        decimals = min(max(int(request.args.get("decimals", 3)), 0), 6)
+    except ValueError:
+        return "Invalid since or decimals.", 400
+    unknown = [k for k in fields if k not in history.index]
+    if unknown:
+        return f"Unknown history field {unknown[0]}.", 400
+    if station not in history.rings:
+        return "Unknown station.", 404
+    if request.args.get("format") == "csv":
+        return Response(
+            history.csv(station, fields, since, decimals), mimetype="text/csv"
+        )
+    return Response(
+        history.json(station, fields, since, decimals), mimetype="application/json"
+    )
+
+
+def received(decoder: Decoder, form):
+    """Decode and ingest the telemetry of a Flask request
+
+    Args:
+        decoder (Decoder): decoder of the protocol
+        form: key-value pairs from the request
+
+    Returns:
+        response text and status
+    """
+    with request_time.time():
+        decoder.posts.inc()
+        status = accept(*decoder.decode_form(form))
+    # the request and failure counters are scraped even if nothing was published
+    exposition.invalidate()
+    if status == 400:
+        return "Invalid telemetry.", 400
+    if status == 503:
+        return "Busy, try again.", 503, {"Retry-After": "5"}
+    return decoder.response
+
+
+def fast_app(environ, start_response):
+    """Lean WSGI handler for the incoming telemetry, bypassing Flask routing and form parsing.
+        The decoder is looked up by method and path, it maps the raw body or query string
+        through its precompiled table. Any other request is passed on to the Flask app
 
-    isReady = False
+    Returns:
+        list[bytes]: response body
+    """
+    decoder = decoders.get((environ["REQUEST_METHOD"], environ["PATH_INFO"]))
+    if decoder is None:
+        return app(environ, start_response)
+
+    start = time.perf_counter()
+    decoder.posts.inc()
+    if decoder.method == "POST":
+        raw = environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))
+    else:
+        raw = environ.get("QUERY_STRING", "").encode("latin-1")
+
+    headers = [("Content-Type", "text/html; charset=utf-8")]
+    status = accept(*decoder.decode(raw))
+    exposition.invalidate()  # the request and failure counters
+    if status == 200:
+        status, text = "200 OK", decoder.response
+    elif status == 400:
+        status, text = "400 BAD REQUEST", b"Invalid telemetry."
+    else:
+        status, text = "503 SERVICE UNAVAILABLE", b"Busy, try again."
+        headers.append(("Retry-After", "5"))
+    headers.append(("Content-Length", str(len(text))))
+    start_response(status, headers)
+    request_time.observe(time.perf_counter() - start)
+    return [text]
+
+
+class PWSCollector:
+    """Custom Prometheus collector - the weather gauges are built at scrape time
+    from the latest telemetry published by each station"""
+
+    def collect(self):
+        with stations_lock:
+            snapshot = list(stations.items())
+
+        # one gauge per pws variable, one series per station
+        families = [
+            GaugeMetricFamily(k, pwsdesc[i], labels=["station"])
+            for i, k in enumerate(pwsvar)
+        ]
+        last = GaugeMetricFamily(
+            "pws_last_ingest_timestamp_seconds",
+            "Time the station last sent valid telemetry",
+            labels=["station"],
+        )
+        for station, values in snapshot:
+            for g, v in zip(families, values):
+                if v == v:  # NaN for the sensors the station does not have
+                    g.add_metric([station], v)
+            last.add_metric([station], values[-1])
+        families.append(last)
+        return families
 
 
 def get_ip() -> str:
@@ -418,32 +447,288 @@ if __name__ == "__main__":
         help="Folder for the local pws.txt data file",
         default=os.getcwd(),
     )
+    parser.add_argument(
+        "-s",
+        "--max_stations",
+        type=int,
+        help="Maximum number of weather stations tracked at once",
+        default=1000,
+    )
+    parser.add_argument(
+        "--log_batch",
+        type=int,
+        help="Maximum number of records written to pws.txt at once",
+        default=100,
+    )
+    parser.add_argument(
+        "--log_linger",
+        type=float,
+        help="Maximum seconds a record waits before being written to pws.txt",
+        default=1.0,
+    )
+    parser.add_argument(
+        "--log_fsync",
+        choices=FSYNC_POLICIES,
+        help="When pws.txt is synced to disk",
+        default="never",
+    )
+    parser.add_argument(
+        "--log_format",
+        choices=["json", "binary"],
+        help="JSON lines in pws.txt or fixed-size binary records in pws.bin",
+        default="json",
+    )
+    parser.add_argument(
+        "--log_max_mb",
+        type=int,
+        help="Start a new pws.txt segment once it reaches this size in MB, 0 for no limit",
+        default=0,
+    )
+    parser.add_argument(
+        "--log_daily",
+        help="Start a new pws.txt segment every UTC day",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--log_compress",
+        choices=list(COMPRESSION),
+        help="Compression of the closed pws.txt segments",
+        default="gzip",
+    )
+    parser.add_argument(
+        "--log_keep",
+        type=int,
+        help="Number of closed pws.txt segments kept, 0 keeps them all",
+        default=0,
+    )
+    parser.add_argument(
+        "--sqlite",
+        help="SQLite database file for the telemetry history, disabled by default",
+        default=None,
+    )
+    parser.add_argument(
+        "--fast_ingest",
+        help="Handle the telemetry POST with the lean WSGI handler instead of Flask",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--async_ingest",
+        help="Acknowledge the telemetry once queued and ingest it in worker greenlets",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--ingest_workers",
+        type=int,
+        help="Worker greenlets of the ingest queue",
+        default=4,
+    )
+    parser.add_argument(
+        "--ingest_queue",
+        type=int,
+        help="Maximum number of records in the ingest queue",
+        default=10000,
+    )
+    parser.add_argument(
+        "--ingest_overflow",
+        choices=OVERFLOW_POLICIES,
+        help="Drop the oldest queued record or reject the request with a 503 when the ingest queue is full",
+        default="drop_oldest",
+    )
+    parser.add_argument(
+        "--single_loop",
+        help="Serve /metrics from the gevent loop of the telemetry server instead of a thread",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--pool_size",
+        type=int,
+        help="Maximum number of connections handled at once, 0 for no limit",
+        default=0,
+    )
+    parser.add_argument(
+        "--keepalive",
+        type=float,
+        help="Seconds an idle keep-alive connection is kept open, 0 closes it after each response",
+        default=None,
+    )
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        help="Seconds without telemetry after which a station and its series are removed, 0 keeps them",
+        default=0,
+    )
+    parser.add_argument(
+        "--remote_write",
+        help="Push the telemetry to this Prometheus remote-write URL",
+        default="",
+    )
+    parser.add_argument(
+        "--remote_write_batch",
+        type=int,
+        help="Maximum number of station records per remote-write request",
+        default=500,
+    )
+    parser.add_argument(
+        "--remote_write_interval",
+        type=float,
+        help="Maximum seconds a record waits before it is pushed",
+        default=5.0,
+    )
+    parser.add_argument(
+        "--remote_write_buffer_mb",
+        type=int,
+        help="Memory cap in MB of the batches kept for a retry while the endpoint is down",
+        default=16,
+    )
+    parser.add_argument(
+        "--aggregate",
+        help="Comma separated fields exported as rolling min/max/mean",
+        default="tempf,windgustmph,rainratein",
+    )
+    parser.add_argument(
+        "--windows",
+        help="Comma separated rolling aggregate windows (s, m, h or d)",
+        default="1m,10m,1h,24h",
+    )
+    parser.add_argument(
+        "--history",
+        type=int,
+        help="Samples kept per station for /history",
+        default=720,
+    )
+    parser.add_argument(
+        "--history_mb",
+        type=int,
+        help="Memory cap of the /history buffer in MB",
+        default=64,
+    )
+    parser.add_argument(
+        "--metrics_max_age",
+        type=float,
+        help="Seconds a rendered /metrics page is served before it is rendered again, new telemetry is served at once",
+        default=10.0,
+    )
     args = parser.parse_args()
-
-    # create the gauges for the PWS variables
-    for i, v in enumerate(pwsvar):
-        # g = Gauge("DateData","Date string data as a metric",["data", "readable_datetime"])
-        # g.labels(data="data", readable_datetime="").set(0)
-        g = Gauge(v, pwsdesc[i])
-        g.set(0)
-        gauges[v] = g
+    for k in args.aggregate.split(","):
+        if k not in pwsvar or k == "dateutc":
+            parser.error(f"unknown field {k} in --aggregate")
+    try:
+        windows = parse_windows(args.windows)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.history < 1:
+        parser.error("--history must be at least 1")
+
+    # the gauges for the PWS variables are built by the collector on every scrape
+    REGISTRY.register(PWSCollector())
+    aggregates = RollingAggregates(
+        args.aggregate.split(","),
+        ["totalrainin"],
+        windows,
+        descs=dict(zip(pwsvar, pwsdesc)),
+    )
+    REGISTRY.register(aggregates)
+    history = HistoryBuffer(
+        history_fields,
+        [schema.index[k] for k in history_fields],
+        args.history,
+        args.history_mb << 20,
+    )
 
     pws_port = args.pws_port
     prom_port = args.port
     data_fld = args.folder
+    max_stations = args.max_stations
+    station_ttl = args.ttl
+    exposition.max_age = args.metrics_max_age
+    if station_ttl > 0:
+        # a quiet station also has to leave the scrapes served from the cache
+        exposition.refresh = expire
+    log_file = os.path.join(data_fld, "pws.txt")
+    if args.log_format == "binary":
+        if args.log_max_mb or args.log_daily:
+            parser.error("pws.bin is not rotated, use --log_format json")
+        # the fields every station sends, the optional sensors are only in pws.txt
+        log_file = os.path.join(data_fld, "pws.bin")
+        log_sink = BinaryLogSink(log_file, history_fields, args.log_fsync)
+    elif args.log_max_mb or args.log_daily:
+        try:
+            compressor = Compressor(log_file, args.log_compress, args.log_keep)
+        except ValueError as e:
+            parser.error(str(e))
+        log_sink = SegmentedLogSink(
+            log_file, args.log_fsync, args.log_max_mb << 20, args.log_daily, compressor
+        )
+    else:
+        log_sink = JSONLogSink(log_file, args.log_fsync)
+    log_writer = BatchWriter(
+        "log",
+        log_sink,
+        args.log_batch,
+        args.log_linger,
+    ).start()
+    if args.sqlite:
+        store_writer = BatchWriter(
+            "sqlite",
+            TelemetryStore(args.sqlite, pwsvar),
+            args.log_batch,
+            args.log_linger,
+        ).start()
+    if args.remote_write:
+        remote_writer = BatchWriter(
+            "remote_write",
+            RemoteWriteSink(
+                args.remote_write,
+                pwsvar,
+                {"job": "pws_client"},
+                max_buffer=args.remote_write_buffer_mb << 20,
+            ),
+            args.remote_write_batch,
+            args.remote_write_interval,
+        ).start()
 
     print("Prometheus client for EasyWeatherPro")
     print(
         f"Listening on 0.0.0.0:{pws_port} from the weather station and sending to Prometheus on 0.0.0.0:{prom_port}"
     )
-    print(f"Logging data to {data_fld}\pws.txt")
+    print(f"Logging data to {log_file}")
+    if args.sqlite:
+        print(f"Storing telemetry in {args.sqlite}")
+    if args.remote_write:
+        print(f"Pushing telemetry to {args.remote_write}")
     print(f"PWS client active on http://{get_ip()}:{pws_port}")
     # setup the personal webserver reciever
-    pws = WSGIServer(("0.0.0.0", pws_port), app)
-    pws.start()
-
-    # start the prometheus scraper endpoint
-    start_http_server(prom_port, "0.0.0.0")
-    while True:
-        process_request()
-        gevent.sleep(30)
+    pool = Pool(args.pool_size) if args.pool_size > 0 else None
+    pws_app = fast_app if args.fast_ingest else app
+    if args.single_loop and prom_port == pws_port:
+        # one listener, /metrics mounted next to the telemetry routes
+        pws_app = mount(pws_app, exposition.wsgi_app)
+    pws = make_server("0.0.0.0", pws_port, pws_app, pool, args.keepalive)
+    # systemctl/docker stop, leave serve_forever so the writers are flushed below
+    gevent.signal_handler(signal.SIGTERM, pws.stop)
+
+    try:
+        # start the prometheus scraper endpoint
+        if not args.single_loop:
+            start_metrics_server(prom_port, "0.0.0.0", exposition.wsgi_app)
+        elif prom_port != pws_port:
+            make_server(
+                "0.0.0.0", prom_port, exposition.wsgi_app, pool, args.keepalive, True
+            ).start()
+        if args.async_ingest:
+            ingest_queue = IngestQueue(
+                ingest, args.ingest_workers, args.ingest_queue, args.ingest_overflow
+            ).start()
+        pws.serve_forever()
+    finally:
+        if ingest_queue is not None:
+            ingest_queue.close()  # ingest the queued telemetry
+        log_writer.close()  # flush the buffered telemetry
+        if store_writer is not None:
+            store_writer.close()
+        if remote_writer is not None:
+            remote_writer.close()
@@ -0,0 +1,265 @@
+"""
+Prometheus remote-write output for the PWS client
+For sites where Prometheus cannot scrape the client, the published telemetry is pushed to a
+remote-write endpoint instead (or as well). Records are queued by publish() and a BatchWriter
+thread (see writer.py) groups them across stations into one WriteRequest per batch.
+
+The WriteRequest protobuf is encoded by hand, there are only three small messages
+
+    WriteRequest { repeated TimeSeries timeseries = 1; }
+    TimeSeries   { repeated Label labels = 1; repeated Sample samples = 2; }
+    Label        { string name = 1; string value = 2; }
+    Sample       { double value = 1; int64 timestamp = 2; }   // milliseconds
+
+and compressed with snappy - python-snappy if it is installed, else a valid snappy stream of
+literals only, which the receivers accept but is not smaller.
+Failed pushes are retried with exponential backoff, batches that still fail are kept in a
+bounded retry buffer and sent again, oldest first, before the next batch.
+"""
+
+import struct
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+
+from prometheus_client import Counter, Gauge, Histogram
+
+try:
+    import snappy  # optional, pip install python-snappy
+except ImportError:
+    snappy = None
+
+remote_samples = Counter(
+    "pws_remote_write_samples_total", "Samples accepted by the remote-write endpoint"
+)
+remote_failures = Counter(
+    "pws_remote_write_failures_total",
+    "Failed remote-write requests, dropped batches are rejected or overflowed",
+    ["reason"],
+)
+remote_buffer = Gauge(
+    "pws_remote_write_buffer_bytes", "Compressed batches waiting to be sent again"
+)
+remote_latency = Histogram(
+    "pws_remote_write_seconds",
+    "Time taken to push one batch",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+
+def varint(n: int) -> bytes:
+    """Protobuf base 128 varint of a non negative integer"""
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def field(number: int, payload: bytes) -> bytes:
+    """Length delimited protobuf field"""
+    return varint(number << 3 | 2) + varint(len(payload)) + payload
+
+
+def label(name: str, value: str) -> bytes:
+    """Encoded Label field of a TimeSeries"""
+    return field(1, field(1, name.encode()) + field(2, value.encode()))
+
+
+def snappy_compress(data: bytes) -> bytes:
+    """Snappy block format, with python-snappy or as literals only
+
+    Args:
+        data (bytes): uncompressed body
+
+    Returns:
+        bytes: snappy compressed body
+    """
+    if snappy is not None:
+        return snappy.compress(data)
+    out = bytearray(varint(len(data)))
+    for i in range(0, len(data), 65536):
+        chunk = data[i : i + 65536]
+        n = len(chunk) - 1
+        if n < 60:
+            out.append(n << 2)
+        elif n < 256:
+            out += bytes([60 << 2, n])
+        else:
+            out += bytes([61 << 2]) + struct.pack("<H", n)
+        out += chunk
+    return bytes(out)
+
+
+class RemoteWriteSink:
+    """BatchWriter sink encoding batches of (station, time, values) as a WriteRequest and
+    pushing them to a remote-write endpoint"""
+
+    def __init__(
+        self,
+        url: str,
+        fields: list[str],
+        labels: dict[str, str] | None = None,
+        timeout: float = 10.0,
+        retries: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        max_buffer: int = 16 << 20,
+    ) -> None:
+        """
+        Args:
+            url (str): remote-write endpoint e.g. http://prometheus:9090/api/v1/write
+            fields (list[str]): field name of each value
+            labels (dict[str, str], optional): labels added to every series e.g. job
+            timeout (float): seconds per request
+            retries (int): attempts per batch before it is moved to the retry buffer
+            backoff (float): first retry delay in seconds, doubled on every retry
+            max_backoff (float): longest retry delay
+            max_buffer (int): bytes of compressed batches kept for a retry, oldest dropped first
+        """
+        self.url = url
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_buffer = max_buffer
+        # encoded name label of each value, the labels of every series
+        self.names = [label("__name__", k) for k in fields]
+        self.sent = range(len(fields))
+        self.labels = dict(labels or {})
+        # encoded labels of each station sorting before and after __name__
+        self.stations: dict[str, tuple[bytes, bytes]] = {}
+        self.buffer: deque[tuple[bytes, int]] = deque()  # (body, samples) to retry
+        self.buffered = 0
+
+    def encode(self, batch: list[tuple[str, float, list[float]]]) -> tuple[bytes, int]:
+        """Encode a batch as a WriteRequest, one time series per station and field
+        with the samples in time order
+
+        Args:
+            batch (list): (station, Unix time, values in fields order), values beyond
+                the fields e.g. the ingest time are not sent
+
+        Returns:
+            tuple[bytes, int]: protobuf body and the number of samples
+        """
+        pack = struct.Struct("<d").pack
+        series: dict[str, list[list[bytes]]] = {}  # samples by station and field
+        count = 0
+        for station, t, values in sorted(batch, key=lambda r: r[1]):
+            # Sample fields, the value as a 64 bit double and the timestamp as a varint,
+            # only the value differs between the samples of a record
+            ts = b"\x10" + varint(int(t * 1000))
+            head = b"\x12" + varint(9 + len(ts)) + b"\x09"
+            columns = series.get(station)
+            if columns is None:
+                columns = series[station] = [[] for _ in self.names]
+            for i in self.sent:
+                v = values[i]
+                if v == v:  # NaN, a sensor the station does not have
+                    columns[i].append(head + pack(v) + ts)
+                    count += 1
+
+        out = []
+        for station, columns in series.items():
+            labels = self.stations.get(station)
+            if labels is None:
+                labels = self.stations[station] = self.station_labels(station)
+            before, after = labels
+            for i in self.sent:
+                if columns[i]:
+                    out.append(
+                        field(1, before + self.names[i] + after + b"".join(columns[i]))
+                    )
+        return b"".join(out), count
+
+    def station_labels(self, station: str) -> tuple[bytes, bytes]:
+        """Encoded labels of the series of a station, sorted by name as remote-write
+        requires, split into those sorting before and after __name__"""
+        labels = sorted({**self.labels, "station": station}.items())
+        before = b"".join(label(k, v) for k, v in labels if k < "__name__")
+        after = b"".join(label(k, v) for k, v in labels if k > "__name__")
+        return before, after
+
+    def push(self, body: bytes) -> str:
+        """POST one compressed WriteRequest
+
+        Returns:
+            str: "ok", "retry" for errors worth retrying or "rejected"
+        """
+        request = urllib.request.Request(
+            self.url,
+            body,
+            {
+                "Content-Encoding": "snappy",
+                "Content-Type": "application/x-protobuf",
+                "User-Agent": "pws_client",
+                "X-Prometheus-Remote-Write-Version": "0.1.0",
+            },
+        )
+        try:
+            with remote_latency.time():
+                with urllib.request.urlopen(request, timeout=self.timeout) as r:
+                    r.read()
+            return "ok"
+        except urllib.error.HTTPError as e:
+            if e.code == 429 or e.code >= 500:
+                remote_failures.labels("http").inc()
+                return "retry"
+            remote_failures.labels("rejected").inc()
+            return "rejected"
+        except OSError:
+            remote_failures.labels("connection").inc()
+            return "retry"
+
+    def send(self, body: bytes) -> str:
+        """Push a batch, retrying with exponential backoff
+
+        Returns:
+            str: "ok", "rejected" or "retry" if every attempt failed and the batch
+                should be kept
+        """
+        delay = self.backoff
+        for attempt in range(self.retries):
+            result = self.push(body)
+            if result != "retry":
+                return result
+            if attempt < self.retries - 1:
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        return "retry"
+
+    def keep(self, body: bytes, count: int) -> None:
+        """Add a batch to the retry buffer, dropping the oldest beyond max_buffer"""
+        self.buffer.append((body, count))
+        self.buffered += len(body)
+        while self.buffered > self.max_buffer and self.buffer:
+            old, _ = self.buffer.popleft()
+            self.buffered -= len(old)
+            remote_failures.labels("overflow").inc()
+        remote_buffer.set(self.buffered)
+
+    def __call__(self, batch: list[tuple[str, float, list[float]]]) -> None:
+        # batches kept from an outage go first, while the endpoint takes them
+        while self.buffer:
+            body, count = self.buffer[0]
+            result = self.send(body)
+            if result == "retry":
+                break
+            self.buffer.popleft()
+            self.buffered -= len(body)
+            if result == "ok":
+                remote_samples.inc(count)
+        remote_buffer.set(self.buffered)
+
+        data, count = self.encode(batch)
+        if not count:
+            return
+        body = snappy_compress(data)
+        result = "retry" if self.buffer else self.send(body)
+        if result == "retry":
+            self.keep(body, count)
+        elif result == "ok":
+            remote_samples.inc(count)
@@ -0,0 +1,215 @@
+"""
+Declarative sensor schema for the PWS client
+Every telemetry field is declared once with its description, the unit the station sends and the
+unit it is exported in. Calculated fields declare the function and the fields it is calculated from.
+At startup the schema is compiled into the field order, the converter callables and the derivations,
+so converting a record is a single loop over the fields it actually holds.
+
+Besides the fields of the outdoor array the Ecowitt protocol carries the extra channels of the
+add-on sensors - WH31 temperature/humidity, WH51 soil moisture, WH41/43 PM2.5, WH55 leak,
+WH57 lightning - and the battery state of each sensor.
+"""
+
+import math
+from array import array
+from typing import Callable, NamedTuple
+
+from weather import (
+    Dewpoint,
+    FeelsLike,
+    Frostpoint,
+    FtoC,
+    InHgtoHPa,
+    MphtoKmh,
+    WindChillIndex,
+)
+
+TIMESTAMP: str = "dateutc"  # sent as a date string, published as Unix time
+
+# (source unit, target unit) -> converter
+UNITS: dict[tuple[str, str], Callable[[float], float]] = {
+    ("°F", "°C"): FtoC,
+    ("inHg", "hPa"): InHgtoHPa,
+    ("mph", "km/h"): MphtoKmh,
+}
+
+
+class Field(NamedTuple):
+    """Telemetry field - name as sent by Ecowitt, description (the gauge HELP text),
+    unit sent by the station and exported unit. A calculated field has the function
+    calculating it and the fields it takes, in the exported units. Optional fields are
+    only sent by stations with the sensor and are not counted as missing."""
+
+    name: str
+    desc: str
+    unit: str = ""
+    target: str = ""
+    derive: Callable[..., float] | None = None
+    inputs: tuple[str, ...] = ()
+    optional: bool = False
+
+
+def channels(n: int, name: str, desc: str, unit: str = "", target: str = ""):
+    """Fields of a multi-channel sensor, name and desc are formatted with the channel number"""
+    return [
+        Field(name.format(i), desc.format(i), unit, target or unit, optional=True)
+        for i in range(1, n + 1)
+    ]
+
+
+SCHEMA: list[Field] = [
+    Field("dateutc", "Time of the reading sent by the station, Unix time"),
+    Field("tempinf", "Indoor temperature °C", "°F", "°C"),
+    Field("humidityin", "Indoor humidity %", "%", "%"),
+    Field("baromrelin", "Barometric pressure hPa (relative)", "inHg", "hPa"),
+    Field("baromabsin", "Barometric pressure hPa (absolute)", "inHg", "hPa"),
+    Field("tempf", "Outdoor temperature °C", "°F", "°C"),
+    Field("humidity", "Outdoor humidity %", "%", "%"),
+    Field("winddir", "Wind direction °", "°", "°"),
+    Field("windspeedmph", "Windspeed Km/h", "mph", "km/h"),
+    Field("windgustmph", "Windsgust Km/h", "mph", "km/h"),
+    Field("maxdailygust", "Max daily wind gust Km/h", "mph", "km/h"),
+    Field("solarradiation", "Solar Radiation w/m^2", "W/m²", "W/m²"),
+    Field("uv", "UV index", "index", "index"),
+    Field("rainratein", "Last 10 minutes rainfall multiplication 6", "in", "in"),
+    Field("eventrainin", "Event rain per hour ml/Hr", "in", "in"),
+    Field("hourlyrainin", "Rain per hour ml/Hr", "in", "in"),
+    Field("dailyrainin", "Rain per day in ml", "in", "in"),
+    Field("weeklyrainin", "Rain per week in ml", "in", "in"),
+    Field("monthlyrainin", "Rain per month in ml", "in", "in"),
+    Field("yearlyrainin", "Rain per year in L", "in", "in"),
+    Field("totalrainin", "Total rain since power on in L", "in", "in"),
+    # calculated AFTER the unit conversions, in this order
+    Field(
+        "dewpt",
+        "Dew point temperature in  °C",
+        "°C",
+        "°C",
+        Dewpoint,
+        ("tempf", "humidity"),
+    ),
+    Field(
+        "chillpt",
+        "Wind chill index °C",
+        "°C",
+        "°C",
+        WindChillIndex,
+        ("tempf", "windspeedmph"),
+    ),
+    Field(
+        "frostpt",
+        "Frost point temperature in °C",
+        "°C",
+        "°C",
+        Frostpoint,
+        ("tempf", "dewpt"),
+    ),
+    Field(
+        "feelslike",
+        'Metservice "Feels Like" °C',
+        "°C",
+        "°C",
+        FeelsLike,
+        ("tempf", "windspeedmph", "humidity"),
+    ),
+    # extra channels of the add-on sensors
+    *channels(8, "temp{}f", "Channel {} temperature °C", "°F", "°C"),
+    *channels(8, "humidity{}", "Channel {} humidity %", "%"),
+    *channels(8, "soilmoisture{}", "Soil moisture channel {} %", "%"),
+    *channels(4, "pm25_ch{}", "PM2.5 channel {} µg/m³", "µg/m³"),
+    *channels(4, "pm25_avg_24h_ch{}", "PM2.5 24h average channel {} µg/m³", "µg/m³"),
+    *channels(4, "leak_ch{}", "Leak detected channel {} (1 = leak)"),
+    Field("lightning_num", "Lightning strikes today", optional=True),
+    Field("lightning", "Last lightning distance Km", "km", "km", optional=True),
+    Field("lightning_time", "Last lightning time (Unix time)", "s", "s", optional=True),
+    # battery state, 0 = OK 1 = low for the on/off ones
+    Field("wh65batt", "WH65 outdoor array battery low", optional=True),
+    Field("wh25batt", "WH25 indoor sensor battery low", optional=True),
+    Field("wh26batt", "WH26 outdoor sensor battery low", optional=True),
+    Field("wh40batt", "WH40 rain gauge battery V", "V", "V", optional=True),
+    Field("wh57batt", "WH57 lightning sensor battery level 0-5", optional=True),
+    Field("wh68batt", "WH68 anemometer battery V", "V", "V", optional=True),
+    Field("wh80batt", "WH80 anemometer battery V", "V", "V", optional=True),
+    *channels(8, "batt{}", "Channel {} sensor battery low"),
+    *channels(8, "soilbatt{}", "Soil moisture channel {} battery V", "V"),
+    *channels(4, "pm25batt{}", "PM2.5 channel {} battery level 0-5"),
+    *channels(4, "leakbatt{}", "Leak channel {} battery level 0-5"),
+]
+
+
+class Schema:
+    """Compiled schema - field order, converters and derivations"""
+
+    def __init__(self, fields: list[Field]) -> None:
+        self.fields = fields
+        self.names: list[str] = [f.name for f in fields]
+        self.descs: list[str] = [f.desc for f in fields]
+        self.index: dict[str, int] = {k: i for i, k in enumerate(self.names)}
+        # fields sent by the stations and fields calculated from them
+        self.received: list[str] = [f.name for f in fields if f.derive is None]
+        self.calculated: list[str] = [f.name for f in fields if f.derive is not None]
+        self.optional: list[str] = [f.name for f in fields if f.optional]
+
+        self.converters: dict[str, Callable[[float], float]] = {}
+        for f in fields:
+            if f.derive is None and f.unit != f.target:
+                if (f.unit, f.target) not in UNITS:
+                    raise ValueError(f"No conversion from {f.unit} to {f.target}")
+                self.converters[f.name] = UNITS[(f.unit, f.target)]
+
+        self.derivations: list[tuple[str, Callable[..., float], tuple[str, ...]]] = [
+            (f.name, f.derive, f.inputs) for f in fields if f.derive is not None
+        ]
+        for name, _, inputs in self.derivations:
+            for k in inputs:
+                if (
+                    k not in self.received
+                    and self.index.get(k, 1 << 30) > self.index[name]
+                ):
+                    raise ValueError(f"{name} is calculated before {k}")
+        # received fields a record must hold for the calculations
+        self.inputs: frozenset[str] = frozenset(
+            k for _, _, inputs in self.derivations for k in inputs if k in self.received
+        )
+
+        # numeric fields -> slot in a row, rows start out as all NaN
+        self.slots: dict[str, int] = {
+            k: i for i, k in enumerate(self.names) if k != TIMESTAMP
+        }
+        self.empty = array("d", [math.nan] * len(self.names))
+
+    def localise(self, record: dict) -> dict:
+        """Convert the fields of a record into the exported units and calculate the derived fields
+
+        Args:
+            record (dict): telemetry as floats except for the dateutc (string)
+
+        Returns:
+            dict: Converted and calculated telemetry, KeyError if a calculation input is missing
+        """
+        converters = self.converters
+        for k, v in record.items():
+            c = converters.get(k)
+            if c is not None:
+                record[k] = c(v)
+        for name, derive, inputs in self.derivations:
+            record[name] = derive(*[record[k] for k in inputs])
+        return record
+
+    def row(self, record: dict) -> array:
+        """Numeric values of a record in schema order, NaN for the fields it does not hold
+        and for the timestamp
+
+        Args:
+            record (dict): converted and calculated telemetry
+
+        Returns:
+            array: one float per schema field
+        """
+        slots = self.slots
+        values = array("d", self.empty)
+        for k, v in record.items():
+            i = slots.get(k)
+            if i is not None:
+                values[i] = v
+        return values
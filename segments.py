@@ -0,0 +1,258 @@
+"""
+Rotated and compressed segments of the pws.txt telemetry log
+The log sink starts a new segment once pws.txt reaches a size or a new UTC day begins. The closed
+segment is renamed with the time it was rotated, e.g. pws.20240528-064542.txt, and compressed by
+a background thread so neither the writer thread nor the ingest path waits for it. Only the newest
+segments are kept.
+
+    SegmentedLogSink - JSONLogSink rotating pws.txt into segments
+    Compressor       - background compression and retention of the closed segments
+    segments()       - rotated segments of a log in time order
+    chunks()         - stream of complete lines across the segments and the live log
+"""
+
+import glob
+import gzip
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+
+from writer import JSONLogSink
+
+try:
+    import zstandard  # optional, pip install zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION: dict[str, str] = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _pattern(path: str) -> re.Pattern:
+    """Segment file names of a log, the groups are the rotation time, the sequence number
+    of the segments rotated within the same second and the compression"""
+    root, ext = os.path.splitext(os.path.basename(path))
+    return re.compile(
+        re.escape(root)
+        + r"\.(\d{8}-\d{6})(?:-(\d+))?"
+        + re.escape(ext)
+        + r"(\.gz|\.zst)?$"
+    )
+
+
+def segments(path: str) -> list[str]:
+    """Rotated segments of a log, oldest first. A segment being compressed is listed once.
+
+    Args:
+        path (str): live log file e.g. pws.txt
+
+    Returns:
+        list[str]: segment files, compressed or not
+    """
+    pattern = _pattern(path)
+    found: dict[tuple, str] = {}
+    for p in glob.glob(glob.escape(os.path.splitext(path)[0]) + ".*"):
+        m = pattern.match(os.path.basename(p))
+        if m is None:
+            continue
+        key = (m.group(1), int(m.group(2) or 0))
+        # prefer the uncompressed file until the compressor has removed it
+        if key not in found or not m.group(3):
+            found[key] = p
+    return [found[k] for k in sorted(found)]
+
+
+def segment_name(path: str, when: float) -> str:
+    """Name of a segment rotated at a time, pws.txt -> pws.20240528-064542.txt
+    followed by -1, -2.. if the previous segment was rotated within the same second
+
+    Args:
+        path (str): live log file
+        when (float): Unix time of the rotation
+
+    Returns:
+        str: segment file name sorting after the existing ones
+    """
+    root, ext = os.path.splitext(path)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(when))
+    existing = segments(path)
+    if existing:
+        m = _pattern(path).match(os.path.basename(existing[-1]))
+        if m.group(1) >= stamp:
+            stamp = m.group(1)
+            return f"{root}.{stamp}-{int(m.group(2) or 0) + 1}{ext}"
+    return f"{root}.{stamp}{ext}"
+
+
+def open_segment(path: str):
+    """Open a segment for binary reading, decompressing it if needed"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is needed to read {path}")
+        return zstandard.open(path, "rb")
+    return open(path, "rb")
+
+
+def chunks(path: str, size: int = 1 << 20):
+    """Read the rotated segments and then the live log in chunks of complete lines
+
+    Args:
+        path (str): live log file e.g. pws.txt
+        size (int): approximate chunk size in bytes
+
+    Yields:
+        tuple[bytes, str]: chunk of lines and the file it was read from
+    """
+    files = segments(path)
+    if os.path.exists(path):
+        files.append(path)
+    for p in files:
+        f = None
+        # compressed meanwhile, or removed by the retention
+        for name in [p, *(p + c for c in COMPRESSION.values() if c)]:
+            try:
+                f = open_segment(name)
+                break
+            except FileNotFoundError:
+                continue
+        if f is None:
+            continue
+        with f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                if not chunk.endswith(b"\n"):
+                    chunk += f.readline()
+                yield chunk, p
+
+
+class Compressor:
+    """Background thread compressing the closed segments and removing the oldest ones"""
+
+    def __init__(self, path: str, method: str = "gzip", keep: int = 0) -> None:
+        """
+        Args:
+            path (str): live log file
+            method (str): none, gzip or zstd
+            keep (int): number of segments kept, 0 keeps them all
+        """
+        if method not in COMPRESSION:
+            raise ValueError(f"Unknown compression {method}")
+        if method == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        self.path = path
+        self.method = method
+        self.keep = keep
+        self.queue: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="log-compressor")
+        self.thread.daemon = True
+        # segments left uncompressed by an earlier run
+        if method != "none":
+            for p in segments(path):
+                if not p.endswith((".gz", ".zst")):
+                    self.queue.put(p)
+
+    def start(self) -> "Compressor":
+        self.thread.start()
+        return self
+
+    def close(self, timeout: float = 60.0) -> None:
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+    def compress(self, path: str) -> None:
+        """Compress a segment next to it and remove the original"""
+        target = path + COMPRESSION[self.method]
+        with open(path, "rb") as src, open(target + ".tmp", "wb") as dst:
+            if self.method == "gzip":
+                with gzip.GzipFile(
+                    os.path.basename(path), "wb", compresslevel=6, fileobj=dst
+                ) as z:
+                    shutil.copyfileobj(src, z, 1 << 20)
+            else:
+                zstandard.ZstdCompressor(level=3).copy_stream(src, dst)
+        os.replace(target + ".tmp", target)
+        os.remove(path)
+
+    def retain(self) -> None:
+        """Remove the oldest segments beyond the number kept"""
+        if self.keep <= 0:
+            return
+        for p in segments(self.path)[: -self.keep]:
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    def run(self) -> None:
+        while True:
+            path = self.queue.get()
+            if path is None:
+                break
+            try:
+                if self.method != "none":
+                    try:
+                        self.compress(path)
+                    except FileNotFoundError:
+                        pass  # removed by the retention while it was queued
+                self.retain()
+            except OSError as e:
+                print(f"log compressor failed on {path}: {e}")
+
+
+class SegmentedLogSink(JSONLogSink):
+    """JSONLogSink starting a new segment of the log by size and/or every UTC day.
+    Runs on the writer thread, the closed segments are compressed by the Compressor."""
+
+    def __init__(
+        self,
+        path: str,
+        fsync: str = "never",
+        max_bytes: int = 0,
+        daily: bool = False,
+        compressor: Compressor | None = None,
+    ) -> None:
+        """
+        Args:
+            path (str): live log file
+            fsync (str): fsync policy, see JSONLogSink
+            max_bytes (int): rotate once the log reaches this size, 0 for no limit
+            daily (bool): rotate when a new UTC day begins
+            compressor (Compressor, optional): compresses and prunes the closed segments
+        """
+        super().__init__(path, fsync)
+        self.max_bytes = max_bytes
+        self.daily = daily
+        self.compressor = (compressor or Compressor(path, "none")).start()
+        self.day: str = ""  # UTC day the live log was started
+
+    def rotate(self) -> None:
+        """Close the live log and hand it to the compressor as a new segment"""
+        super().close()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        segment = segment_name(self.path, time.time())
+        os.replace(self.path, segment)
+        self.compressor.queue.put(segment)
+
+    def __call__(self, batch: list[dict]) -> None:
+        today = time.strftime("%Y%m%d", time.gmtime())
+        if self.f is None and os.path.exists(self.path):
+            # the day the existing log was last written
+            self.day = time.strftime("%Y%m%d", time.gmtime(os.path.getmtime(self.path)))
+        if self.daily and self.day and self.day != today:
+            self.rotate()
+        self.day = today
+        super().__call__(batch)
+        if self.max_bytes and self.f.tell() >= self.max_bytes:
+            self.rotate()
+
+    def close(self) -> None:
+        super().close()
+        self.compressor.close()
@@ -0,0 +1,76 @@
+"""
+gevent HTTP serving for the PWS client
+By default the telemetry is received by a gevent WSGIServer and /metrics is served by a threaded
+server (see exposition.py). In single loop mode (--single_loop) the metrics app is served by the
+same gevent loop instead - on its own listener, or mounted at /metrics when both ports are the
+same - so no OS threads are mixed with the greenlets.
+
+Both listeners can share one bounded pool of connection greenlets (--pool_size), idle keep-alive
+connections are closed after --keepalive seconds.
+"""
+
+import gevent
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIHandler, WSGIServer
+
+
+class KeepAliveHandler(WSGIHandler):
+    """WSGIHandler closing idle keep-alive connections. keepalive is the number of seconds
+    to wait for the next request, None waits forever and 0 closes the connection after
+    every response."""
+
+    keepalive: float | None = None
+
+    def read_requestline(self):
+        if not self.keepalive:
+            return super().read_requestline()
+        with gevent.Timeout(self.keepalive, False):
+            return super().read_requestline()
+        return ""  # idle, close the connection
+
+    def handle_one_response(self):
+        if self.keepalive == 0:
+            self.close_connection = True
+        return super().handle_one_response()
+
+
+def mount(app, metrics_app, path: str = "/metrics"):
+    """WSGI app dispatching a path to the metrics app and anything else to app"""
+
+    def dispatch(environ, start_response):
+        if environ.get("PATH_INFO") == path:
+            return metrics_app(environ, start_response)
+        return app(environ, start_response)
+
+    return dispatch
+
+
+def make_server(
+    addr: str,
+    port: int,
+    app,
+    pool: Pool | None = None,
+    keepalive: float | None = None,
+    quiet: bool = False,
+) -> WSGIServer:
+    """gevent WSGIServer with an optional shared connection pool and keep-alive limit
+
+    Args:
+        addr (str): listening address
+        port (int): listening port
+        app: WSGI app
+        pool (Pool, optional): greenlet pool of the connections, unbounded by default
+        keepalive (float, optional): idle seconds of a keep-alive connection, see KeepAliveHandler
+        quiet (bool): do not log the requests
+
+    Returns:
+        WSGIServer: server, not started yet
+    """
+    handler = type("Handler", (KeepAliveHandler,), {"keepalive": keepalive})
+    return WSGIServer(
+        (addr, port),
+        app,
+        spawn=pool if pool is not None else "default",
+        handler_class=handler,
+        log=None if quiet else "default",
+    )
@@ -0,0 +1,162 @@
+"""
+SQLite time-series store for the PWS client telemetry
+The database runs in WAL mode so the time-range reads never block the batched inserts
+coming from the background writer (see writer.py).
+
+    station   - station id and name (the "station" label)
+    telemetry - one row per station per timestamp, one REAL column per telemetry field,
+                clustered on (station, ts) for fast time-range reads
+"""
+
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+
+def parse_dateutc(dateutc: str) -> float:
+    """Convert the PWS dateutc string into a Unix timestamp
+
+    Args:
+        dateutc (str): UTC date as sent by the station e.g. '2024-06-03 01:02:17' or 'now'
+
+    Returns:
+        float: seconds since the epoch, the current time if the date is invalid
+    """
+    try:
+        dt = datetime.strptime(dateutc, "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return time.time()
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+class TelemetryStore:
+    """Time-range queries over the telemetry database. Also used as the sink of the
+    BatchWriter inserting the records, each batch being a single transaction.
+    """
+
+    def __init__(self, path: str, fields: list[str]) -> None:
+        """
+        Args:
+            path (str): SQLite database file
+            fields (list[str]): telemetry fields stored as columns, dateutc is the row timestamp
+        """
+        self.path = path
+        self.fields = [f for f in fields if f != "dateutc"]
+        self.db = None  # writer connection, opened by the writer thread
+        self.station_ids: dict[str, int] = {}
+
+        db = self.connect()
+        try:
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS station ("
+                    "id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)"
+                )
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS telemetry ("
+                    "station INTEGER NOT NULL, ts INTEGER NOT NULL, "
+                    "PRIMARY KEY (station, ts)) WITHOUT ROWID"
+                )
+                # new telemetry fields are added as columns to existing databases
+                columns = {r[1] for r in db.execute("PRAGMA table_info(telemetry)")}
+                for f in self.fields:
+                    if f not in columns:
+                        db.execute(f'ALTER TABLE telemetry ADD COLUMN "{f}" REAL')
+        finally:
+            db.close()
+
+        names = ", ".join(f'"{f}"' for f in self.fields)
+        marks = ", ".join("?" for _ in self.fields)
+        self.insert_sql = (
+            f"INSERT OR REPLACE INTO telemetry (station, ts, {names}) "
+            f"VALUES (?, ?, {marks})"
+        )
+
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def station_id(self, name: str) -> int:
+        sid = self.station_ids.get(name)
+        if sid is None:
+            self.db.execute("INSERT OR IGNORE INTO station (name) VALUES (?)", (name,))
+            sid = self.db.execute(
+                "SELECT id FROM station WHERE name = ?", (name,)
+            ).fetchone()[0]
+            self.station_ids[name] = sid
+        return sid
+
+    def __call__(self, batch: list[dict]) -> None:
+        """Insert a batch of telemetry records in one transaction
+
+        Args:
+            batch (list[dict]): records with a station, dateutc and the telemetry fields
+        """
+        if self.db is None:
+            self.db = self.connect()
+        known = set(self.station_ids)
+        try:
+            with self.db:
+                rows = [
+                    (
+                        self.station_id(r.get("station", "")),
+                        int(parse_dateutc(r.get("dateutc"))),
+                        *[r.get(f) for f in self.fields],
+                    )
+                    for r in batch
+                ]
+                self.db.executemany(self.insert_sql, rows)
+        except Exception:
+            # the new station rows were rolled back with the batch, forget their ids
+            for name in self.station_ids.keys() - known:
+                del self.station_ids[name]
+            raise
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def stations(self) -> list[str]:
+        """Names of the stations in the database"""
+        db = self.connect()
+        try:
+            return [r[0] for r in db.execute("SELECT name FROM station ORDER BY name")]
+        finally:
+            db.close()
+
+    def query(
+        self,
+        station: str,
+        start: float,
+        end: float | None = None,
+        fields: list[str] | None = None,
+    ) -> list[tuple]:
+        """Read the telemetry of a station between two timestamps
+
+        Args:
+            station (str): station name
+            start (float): first timestamp (inclusive) in seconds since the epoch
+            end (float, optional): last timestamp (inclusive), defaults to now
+            fields (list[str], optional): columns to read, defaults to all fields
+
+        Returns:
+            list[tuple]: (ts, field values...) rows in time order
+        """
+        fields = self.fields if fields is None else fields
+        for f in fields:
+            if f not in self.fields:
+                raise ValueError(f"Unknown telemetry field {f}")
+        end = time.time() if end is None else end
+        names = ", ".join(f't."{f}"' for f in fields)
+        db = self.connect()
+        try:
+            return db.execute(
+                f"SELECT t.ts, {names} FROM telemetry t JOIN station s ON s.id = t.station "
+                "WHERE s.name = ? AND t.ts BETWEEN ? AND ? ORDER BY t.ts",
+                (station, int(start), int(end)),
+            ).fetchall()
+        finally:
+            db.close()
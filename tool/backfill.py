@@ -0,0 +1,248 @@
+"""
+Backfill/replay tool for the pws.txt telemetry history, run from the repository root
+
+    python tool/backfill.py pws.txt --out pws_fixed.txt
+    python tool/backfill.py pws.txt --sqlite pws.db
+    python tool/backfill.py pws.txt --segments --sqlite pws.db
+    python tool/backfill.py pws.txt --bin pws.bin
+
+The JSON-lines log is memory-mapped and parsed a chunk at a time, so memory use is bounded
+whatever the size of the log. Each chunk is turned into columns and the calculated telemetry
+(dew point, frost point, wind chill and "Feels Like") is derived again with vectorized.py.
+Records without the temperature, humidity or wind speed are kept without the calculated fields.
+pws.txt holds already converted telemetry, use --raw for logs in the station's imperial units
+(e.g. the form data captured by dumper.py) to run the unit conversions too.
+--segments replays the rotated and compressed segments of the log first, oldest first.
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import sys
+import time
+from operator import itemgetter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import segments  # noqa: E402
+import vectorized  # noqa: E402
+from binlog import BinaryLogSink  # noqa: E402
+from schema import SCHEMA, TIMESTAMP, Schema  # noqa: E402
+from store import TelemetryStore  # noqa: E402
+
+# the field lists of main.py, without importing main and its server setup
+schema = Schema(SCHEMA)
+pwsvar: list[str] = schema.names
+calculated: list[str] = schema.calculated
+history_fields: list[str] = [
+    k for k in pwsvar if k != TIMESTAMP and k not in schema.optional
+]
+numeric: list[str] = [k for k in pwsvar if k != TIMESTAMP]
+
+
+def parse(chunk: bytes) -> tuple[list[dict], int]:
+    """Parse a chunk of JSON lines, in one go if it is well formed
+
+    Args:
+        chunk (bytes): complete lines of the log
+
+    Returns:
+        tuple[list[dict], int]: the records and the number of invalid lines skipped
+    """
+    try:
+        return json.loads(b"[" + chunk.strip().replace(b"\n", b",") + b"]"), 0
+    except ValueError:
+        pass
+    # blank or broken lines, fall back to one line at a time
+    records = []
+    bad = 0
+    for line in chunk.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            bad += 1
+    return records, bad
+
+
+def chunks(path: str, size: int):
+    """Memory-mapped read of the log in chunks of complete lines
+
+    Args:
+        path (str): JSON-lines log
+        size (int): approximate chunk size in bytes
+
+    Yields:
+        tuple[bytes, int]: chunk of lines and the file offset after it
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            pos = 0
+            end = len(m)
+            while pos < end:
+                stop = m.find(b"\n", min(pos + size, end - 1))
+                stop = end if stop < 0 else stop + 1
+                yield m[pos:stop], stop
+                pos = stop
+
+
+def segmented(path: str, size: int):
+    """Read the rotated segments and the live log in chunks of lines, see segments.chunks
+
+    Yields:
+        tuple[bytes, int]: chunk of lines and the number of bytes read so far
+    """
+    offset = 0
+    for chunk, _ in segments.chunks(path, size):
+        offset += len(chunk)
+        yield chunk, offset
+
+
+def process(records: list[dict], raw: bool) -> tuple[list[dict], int]:
+    """Derive the calculated telemetry of a batch of records, in place
+
+    Args:
+        records (list[dict]): telemetry records
+        raw (bool): the records are in the station's imperial units
+
+    Returns:
+        tuple[list[dict], int]: the updated records and the number of them without
+            an input of the calculations, these are kept without the calculated fields
+    """
+    # only the fields the stations send, most logs have few of the optional sensors.
+    # Taken from every record, a sensor may only be in the later records of the chunk
+    present = set().union(*records)
+    fields = [k for k in numeric if k in present]
+    n = len(records)
+    try:
+        # one row per record, in a single pass when every record has the same fields
+        rows = np.array(list(map(itemgetter(*fields), records)), np.float64)
+        columns = {k: rows[:, i].copy() for i, k in enumerate(fields)}
+    except (IndexError, KeyError, TypeError, ValueError):
+        nan = math.nan
+        columns = {
+            k: np.fromiter((r.get(k, nan) for r in records), np.float64, n)
+            for k in fields
+        }
+    # the live ingest drops the records without an input of the calculations, here
+    # they are kept as they are and their calculated fields are NaN and not written
+    complete = np.fromiter((r.keys() >= schema.inputs for r in records), np.bool_, n)
+    incomplete = n - int(complete.sum())
+    for k in schema.inputs.difference(columns):
+        columns[k] = np.full(n, math.nan)
+    if raw:
+        columns = vectorized.LocaliseColumns(columns)
+        changed = list(columns)
+    else:
+        columns = vectorized.DeriveColumns(columns)
+        changed = calculated
+    if incomplete:
+        for k in calculated:
+            columns[k][~complete] = math.nan
+    for k in changed:
+        for r, v in zip(records, columns[k].tolist()):
+            if not math.isnan(v):
+                r[k] = v
+    return records, incomplete
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="backfill")
+    parser.add_argument("log", help="JSON-lines telemetry log e.g. pws.txt")
+    parser.add_argument("-o", "--out", help="JSON-lines output file", default=None)
+    parser.add_argument("--sqlite", help="SQLite database output", default=None)
+    parser.add_argument("--bin", help="Binary log output, see binlog.py", default=None)
+    parser.add_argument(
+        "--raw",
+        help="The log holds the station's imperial units, convert them too",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--segments",
+        help="Read the rotated segments of the log too, oldest first",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk",
+        type=int,
+        help="Chunk size in MB read and processed at once",
+        default=8,
+    )
+    args = parser.parse_args()
+    if not args.out and not args.sqlite and not args.bin:
+        parser.error("one of --out, --sqlite or --bin is required")
+
+    out = open(args.out, "w") if args.out else None
+    db = TelemetryStore(args.sqlite, pwsvar) if args.sqlite else None
+    binary = BinaryLogSink(args.bin, history_fields) if args.bin else None
+
+    if args.segments:
+        # compressed segments have no known size, progress is in bytes read
+        total = 0
+        source = segmented(args.log, args.chunk << 20)
+    else:
+        total = os.path.getsize(args.log)
+        source = chunks(args.log, args.chunk << 20)
+    count = bad = incomplete = 0
+    start = last = time.perf_counter()
+    try:
+        for chunk, offset in source:
+            records, skipped = parse(chunk)
+            bad += skipped
+            if not records:
+                continue
+            records, missing = process(records, args.raw)
+            incomplete += missing
+            if out is not None:
+                out.write("\n".join(map(json.dumps, records)))
+                out.write("\n")
+            if db is not None:
+                db(records)
+            if binary is not None:
+                binary(records)
+            count += len(records)
+
+            now = time.perf_counter()
+            if now - last >= 1.0 or offset == total:
+                last = now
+                secs = now - start
+                done = (
+                    f"{offset * 100 / total:5.1f}%" if total else f"{offset >> 20} MB"
+                )
+                print(
+                    f"\r{done} {count} records "
+                    f"{offset / secs / 1e6:.1f} MB/s {count / secs:.0f} records/s",
+                    end="",
+                    file=sys.stderr,
+                )
+    finally:
+        if out is not None:
+            out.close()
+        if db is not None:
+            db.close()
+        if binary is not None:
+            binary.close()
+
+    secs = time.perf_counter() - start
+    print(
+        f"\n{count} records ({bad} invalid lines skipped, {incomplete} without "
+        f"the {'/'.join(sorted(schema.inputs))} for the calculations) in {secs:.1f}s",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Benchmark of the telemetry POST handlers, run from the repository root
+
+    python tool/bench_ingest.py -n 20000
+
+The Flask route (main.app) and the lean WSGI handler (main.fast_app, --fast_ingest) are called
+directly with the same Ecowitt POST body as in data_dumps.md, so the figures are the handler cost
+without the HTTP server. pws.txt writes are discarded.
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from aggregates import RollingAggregates, parse_windows  # noqa: E402
+from history import HistoryBuffer  # noqa: E402
+from writer import BatchWriter  # noqa: E402
+
+FORM: dict[str, str] = {
+    "PASSKEY": "0",
+    "stationtype": "EasyWeatherPro_V5.1.6",
+    "runtime": "267786",
+    "heap": "24292",
+    "dateutc": "2024-05-28 06:45:42",
+    "tempinf": "62.1",
+    "humidityin": "55",
+    "baromrelin": "29.743",
+    "baromabsin": "29.754",
+    "tempf": "52.2",
+    "humidity": "70",
+    "winddir": "282",
+    "windspeedmph": "0.00",
+    "windgustmph": "0.00",
+    "maxdailygust": "11.41",
+    "solarradiation": "0.00",
+    "uv": "0",
+    "rainratein": "0.000",
+    "eventrainin": "0.000",
+    "hourlyrainin": "0.000",
+    "dailyrainin": "0.000",
+    "weeklyrainin": "0.000",
+    "monthlyrainin": "0.071",
+    "yearlyrainin": "0.071",
+    "totalrainin": "0.071",
+    "wh65batt": "0",
+    "freq": "433M",
+    "model": "WS2900_V2.02.03",
+    "interval": "30",
+}
+
+
+def environ(body: bytes) -> dict:
+    env: dict = {
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": "/telemetry",
+        "CONTENT_TYPE": "application/x-www-form-urlencoded",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+    }
+    setup_testing_defaults(env)
+    return env
+
+
+def run(wsgi_app, bodies: list[bytes]) -> float:
+    """Call the WSGI app once per body
+
+    Returns:
+        float: requests per second
+    """
+
+    def start_response(status, headers):
+        assert status.startswith("200"), status
+
+    start = time.perf_counter()
+    for body in bodies:
+        b"".join(wsgi_app(environ(body), start_response))
+    return len(bodies) / (time.perf_counter() - start)
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser(description="bench_ingest")
+    parser.add_argument(
+        "-n", "--requests", type=int, help="Requests per run", default=20000
+    )
+    parser.add_argument(
+        "-s", "--stations", type=int, help="Distinct PASSKEYs", default=300
+    )
+    parser.add_argument("-r", "--runs", type=int, help="Runs per handler", default=3)
+    args = parser.parse_args()
+
+    main.log_writer = BatchWriter("log", lambda batch: None, 1000, 1.0).start()
+    # the default --aggregate, --windows and --history of main.py
+    main.aggregates = RollingAggregates(
+        ["tempf", "windgustmph", "rainratein"],
+        ["totalrainin"],
+        parse_windows("1m,10m,1h,24h"),
+    )
+    main.history = HistoryBuffer(
+        main.history_fields,
+        [main.schema.index[k] for k in main.history_fields],
+        720,
+        64 << 20,
+    )
+    bodies = [
+        urlencode(dict(FORM, PASSKEY=f"{i % args.stations:032x}")).encode()
+        for i in range(args.requests)
+    ]
+    print(f"{len(bodies[0])} byte body, {args.requests} requests per run")
+
+    results = {}
+    for name, wsgi_app in [("flask", main.app), ("fast", main.fast_app)]:
+        run(wsgi_app, bodies[:1000])  # warm up
+        results[name] = max(run(wsgi_app, bodies) for _ in range(args.runs))
+        print(f"{name:6} {results[name]:10.0f} requests/s")
+    print(f"gain   {results['fast'] / results['flask']:10.2f}x")
+    main.log_writer.close()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,123 @@
+"""
+Equivalence check of the vectorised weather calculations (vectorized.py) against the scalar
+functions in weather.py and the schema conversions, run from the repository root
+
+    python tool/check_vectorized.py -n 1000000
+
+Inputs cover the station measurement ranges plus values landing exactly on rounding ties.
+Rounded results must be identical, the unrounded FeelsLike equal to within 1e-12. Checked are
+the rounding of the ties themselves, LocaliseColumns on the imperial telemetry (as --raw in
+backfill.py) and DeriveColumns on the converted telemetry (as pws.txt holds it).
+The exit status is 1 on any mismatch, so the script can be run as the check of a build.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vectorized  # noqa: E402
+from schema import SCHEMA, Schema  # noqa: E402
+
+
+def inputs(n: int, seed: int) -> dict[str, np.ndarray]:
+    """Random station telemetry in imperial units, as sent by the PWS"""
+    rng = np.random.default_rng(seed)
+    cols = {
+        "tempf": rng.uniform(-40, 120, n),
+        "tempinf": rng.uniform(30, 100, n),
+        "humidity": rng.uniform(1, 100, n),
+        "baromrelin": rng.uniform(27, 32, n),
+        "baromabsin": rng.uniform(27, 32, n),
+        "windspeedmph": rng.uniform(0, 60, n),
+        "windgustmph": rng.uniform(0, 90, n),
+        "maxdailygust": rng.uniform(0, 90, n),
+        "temp1f": rng.uniform(-40, 120, n),
+    }
+    # the station sends 1 or 2 decimals, these hit the rounding ties of FtoC and friends
+    for k in ["tempf", "tempinf", "temp1f", "windspeedmph"]:
+        cols[k][: n // 2] = np.round(cols[k][: n // 2], 2)
+    cols["humidity"][: n // 2] = np.round(cols["humidity"][: n // 2])
+    return cols
+
+
+def scalar(cols: dict[str, np.ndarray], convert: bool = True) -> dict[str, np.ndarray]:
+    """Same conversions as Schema.localise in schema.py, one record at a time,
+    or only the calculated fields if the telemetry is already converted"""
+    schema = Schema(SCHEMA)
+    keys = list(cols) + schema.calculated
+    out: dict[str, list] = {k: [] for k in keys}
+    lists = {k: v.tolist() for k, v in cols.items()}
+    for i in range(len(cols["tempf"])):
+        record = {k: v[i] for k, v in lists.items()}
+        if convert:
+            schema.localise(record)
+        else:
+            for name, derive, args in schema.derivations:
+                record[name] = derive(*[record[k] for k in args])
+        for k in keys:
+            out[k].append(record[k])
+    return {k: np.array(v, dtype=np.float64) for k, v in out.items()}
+
+
+def compare(title: str, expected: dict, actual: dict) -> bool:
+    """Print the mismatches of each column, True if there are none"""
+    print(title)
+    ok = True
+    for k, v in expected.items():
+        if k == "feelslike":
+            bad = ~np.isclose(actual[k], v, rtol=1e-12, atol=1e-12)
+        else:
+            bad = actual[k] != v
+        print(f"  {k:14} {int(bad.sum()):8} mismatches")
+        if bad.any():
+            i = int(np.flatnonzero(bad)[0])
+            print(
+                f"  {'':14} first at {i}: scalar {v[i]!r} vectorised {actual[k][i]!r}"
+            )
+            ok = False
+    return ok
+
+
+def ties() -> bool:
+    """_round against round() on values whose binary form is just below or above a tie"""
+    x = np.array(
+        [0.05, 0.15, 0.25, 0.35, 0.45, 1.05, 2.675, -0.15, -2.45, 0.5, 1.5, 2.5]
+    )
+    x = np.concatenate([x, -x, x * 10, np.nextafter(x, 0), np.nextafter(x, 10)])
+    ok = True
+    for ndigits in (0, 1, 2):
+        expected = np.array([round(v, ndigits) for v in x.tolist()])
+        bad = vectorized._round(x, ndigits) != expected
+        print(f"_round {ndigits} digits {int(bad.sum()):8} mismatches")
+        ok = ok and not bad.any()
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="check_vectorized")
+    parser.add_argument(
+        "-n", "--records", type=int, help="Number of records", default=200000
+    )
+    parser.add_argument("--seed", type=int, help="Random seed", default=1)
+    args = parser.parse_args()
+
+    ok = ties()
+    cols = inputs(args.records, args.seed)
+    expected = scalar(cols)
+    actual = vectorized.LocaliseColumns({k: v.copy() for k, v in cols.items()})
+    ok = compare("LocaliseColumns", expected, actual) and ok
+
+    # the converted telemetry as logged, the calculations only
+    metric = {k: expected[k] for k in cols}
+    expected = scalar(metric, convert=False)
+    actual = vectorized.DeriveColumns({k: v.copy() for k, v in metric.items()})
+    ok = compare("DeriveColumns", expected, actual) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Load generator for the /telemetry ingest endpoint of a running PWS client
+
+    python main.py --folder /tmp
+    python tool/loadgen.py --rates 100,200,400,800,1600 --stations 500 -o run.json
+
+Synthesises Ecowitt POSTs (the format in data_dumps.md) with random but realistic values and
+many distinct PASSKEYs and sends them at a fixed rate for each of the given rates. Latency is
+measured from the time a request was due rather than when it was sent, so a saturated server
+shows up as growing latency instead of a lower request rate.
+The saturation point is the first rate which is not sustained, errors or exceeds the p99 target.
+Results are written as JSON so runs of different versions can be compared.
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import http.client  # noqa: E402
+import json  # noqa: E402
+import random  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+from datetime import datetime, timezone  # noqa: E402
+from urllib.parse import urlencode, urlsplit  # noqa: E402
+
+import gevent  # noqa: E402
+from gevent.queue import Queue  # noqa: E402
+
+
+def payload(passkey: str, rng: random.Random) -> bytes:
+    """Random Ecowitt POST body in the station's imperial units"""
+    tempf = rng.uniform(20, 100)
+    rain = rng.choice([0.0, 0.0, 0.0, rng.uniform(0, 2)])
+    form = {
+        "PASSKEY": passkey,
+        "stationtype": "EasyWeatherPro_V5.1.6",
+        "runtime": str(rng.randint(1, 10**6)),
+        "heap": str(rng.randint(20000, 30000)),
+        "dateutc": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "tempinf": f"{rng.uniform(55, 80):.1f}",
+        "humidityin": str(rng.randint(30, 70)),
+        "baromrelin": f"{rng.uniform(29.0, 30.5):.3f}",
+        "baromabsin": f"{rng.uniform(29.0, 30.5):.3f}",
+        "tempf": f"{tempf:.1f}",
+        "humidity": str(rng.randint(10, 100)),
+        "winddir": str(rng.randint(0, 359)),
+        "windspeedmph": f"{rng.uniform(0, 30):.2f}",
+        "windgustmph": f"{rng.uniform(0, 45):.2f}",
+        "maxdailygust": f"{rng.uniform(0, 60):.2f}",
+        "solarradiation": f"{rng.uniform(0, 1000):.2f}",
+        "uv": str(rng.randint(0, 11)),
+        "rainratein": f"{rain:.3f}",
+        "eventrainin": f"{rain:.3f}",
+        "hourlyrainin": f"{rain:.3f}",
+        "dailyrainin": f"{rain * 3:.3f}",
+        "weeklyrainin": f"{rain * 7:.3f}",
+        "monthlyrainin": f"{rain * 20:.3f}",
+        "yearlyrainin": f"{rain * 100:.3f}",
+        "totalrainin": f"{rain * 100:.3f}",
+        "wh65batt": "0",
+        "freq": "433M",
+        "model": "WS2900_V2.02.03",
+        "interval": "30",
+    }
+    return urlencode(form).encode()
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(url: str, rate: float, duration: float, concurrency: int, stations: int):
+    """Send POSTs at a fixed rate for a while
+
+    Args:
+        url (str): telemetry endpoint
+        rate (float): requests per second
+        duration (float): seconds
+        concurrency (int): number of connections
+        stations (int): number of distinct PASSKEYs
+
+    Returns:
+        dict: achieved rate, latency percentiles in ms and error counts
+    """
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    rng = random.Random(rate)
+    passkeys = [f"{i:032X}" for i in range(stations)]
+    due: Queue = Queue()
+    latencies: list[float] = []
+    errors: dict[str, int] = {}
+
+    def worker():
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+        while True:
+            scheduled = due.get()
+            if scheduled is None:
+                break
+            body = payload(rng.choice(passkeys), rng)
+            try:
+                conn.request(
+                    "POST",
+                    path,
+                    body,
+                    {"Content-Type": "application/x-www-form-urlencoded"},
+                )
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors[str(response.status)] = (
+                        errors.get(str(response.status), 0) + 1
+                    )
+                latencies.append(time.perf_counter() - scheduled)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                conn.close()
+                conn = http.client.HTTPConnection(
+                    parts.hostname, parts.port or 80, timeout=10
+                )
+        conn.close()
+
+    workers = [gevent.spawn(worker) for _ in range(concurrency)]
+    total = int(rate * duration)
+    start = time.perf_counter()
+    for i in range(total):
+        scheduled = start + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            gevent.sleep(delay)
+        due.put(scheduled)
+    for _ in workers:
+        due.put(None)
+    gevent.joinall(workers)
+    elapsed = time.perf_counter() - start
+
+    ms = [v * 1000 for v in latencies]
+    failed = sum(errors.values())
+    return {
+        "rate": rate,
+        "requests": total,
+        "achieved": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "max_ms": round(max(ms, default=0.0), 2),
+        "errors": errors,
+        "error_rate": round(failed / total, 4) if total else 0.0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="loadgen")
+    parser.add_argument(
+        "-u",
+        "--url",
+        help="Telemetry endpoint",
+        default="http://127.0.0.1:1111/telemetry",
+    )
+    parser.add_argument(
+        "-r",
+        "--rates",
+        help="Comma separated requests per second, one run each",
+        default="50,100,200,400,800",
+    )
+    parser.add_argument(
+        "-d", "--duration", type=float, help="Seconds per run", default=10.0
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, help="Concurrent connections", default=50
+    )
+    parser.add_argument(
+        "-s", "--stations", type=int, help="Distinct station PASSKEYs", default=300
+    )
+    parser.add_argument(
+        "--p99", type=float, help="p99 latency target in ms", default=100.0
+    )
+    parser.add_argument(
+        "--max_errors", type=float, help="Highest acceptable error rate", default=0.01
+    )
+    parser.add_argument("-l", "--label", help="Version label of the run", default="")
+    parser.add_argument("-o", "--out", help="JSON results file", default=None)
+    args = parser.parse_args()
+
+    results = []
+    saturation = None
+    for rate in [float(r) for r in args.rates.split(",")]:
+        r = run(args.url, rate, args.duration, args.concurrency, args.stations)
+        r["saturated"] = (
+            r["achieved"] < 0.95 * rate
+            or r["error_rate"] > args.max_errors
+            or r["p99_ms"] > args.p99
+        )
+        results.append(r)
+        print(
+            f"{rate:8.0f}/s achieved {r['achieved']:8.1f}/s "
+            f"p50 {r['p50_ms']:7.2f} p95 {r['p95_ms']:7.2f} p99 {r['p99_ms']:7.2f} ms "
+            f"errors {r['error_rate']:.2%}{'  SATURATED' if r['saturated'] else ''}"
+        )
+        if r["saturated"]:
+            saturation = rate
+            break
+
+    if saturation is None:
+        print("Not saturated, try higher rates")
+    else:
+        print(f"Saturated at {saturation:.0f} requests/s")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(
+                {
+                    "label": args.label,
+                    "url": args.url,
+                    "time": datetime.now(timezone.utc).isoformat(),
+                    "duration": args.duration,
+                    "concurrency": args.concurrency,
+                    "stations": args.stations,
+                    "p99_target_ms": args.p99,
+                    "saturation": saturation,
+                    "runs": results,
+                },
+                f,
+                indent=2,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
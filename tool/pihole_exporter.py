@@ -22,115 +22,476 @@
 #   SOFTWARE.
 
 import argparse
+import codecs
+import collections
+import gzip
+import http.client
 import json
+import math
+import queue
 import socket
-import urllib.request
-from io import StringIO
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from socketserver import ThreadingMixIn
+from urllib.parse import quote
+from wsgiref import simple_server
 
-from prometheus_metrics import exporter, generate_latest
+from prometheus_client import (REGISTRY, Counter, Gauge, Histogram,
+                               generate_latest, make_wsgi_app)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
+api_request_seconds = Histogram(
+    'pihole_api_request_seconds',
+    'Time taken by a Pi-hole API call',
+    ['instance', 'endpoint'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+api_errors = Counter(
+    'pihole_api_errors_total',
+    'Failed Pi-hole API calls',
+    ['instance', 'endpoint'])
+snapshot_age = Gauge(
+    'pihole_snapshot_age_seconds',
+    'Seconds since the served Pi-hole data was last fetched successfully',
+    ['instance'])
+refreshes = Counter(
+    'pihole_refreshes_total',
+    'Polls of the Pi-hole API',
+    ['instance'])
 
-class pihole_exporter(exporter):
-    def __init__(self, url, auth, extended=False):
-        super().__init__()
+
+# API result key -> metric name and label of its items
+ITEMS = {
+    'top_queries': ('pihole_top_queries', 'domain'),
+    'top_ads': ('pihole_top_ads', 'domain'),
+    'top_sources': ('pihole_top_sources', 'client'),
+    'forward_destinations': ('pihole_forward_destinations', 'resolver'),
+    'querytypes': ('pihole_query_type', 'query_type'),
+}
+
+
+class connection_pool():
+    """Keep-alive HTTP connections to the Pi-hole, one per concurrent request"""
+
+    def __init__(self, host, size):
+        self.host = host
+        self.idle = queue.LifoQueue(size)
+
+    def request(self, path, timeout):
+        """GET a path, returns the connection and the response to be read"""
+        for attempt in range(2):
+            try:
+                conn = self.idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = http.client.HTTPConnection(self.host, timeout=timeout)
+                reused = False
+            try:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+                response = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                # a keep-alive connection closed by the server, try a fresh one
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.status != 200:
+                response.read()
+                self.release(conn, response)
+                raise http.client.HTTPException(
+                    f'{path.split("&")[0]} returned {response.status}')
+            return conn, response
+
+    def release(self, conn, response):
+        """Keep a connection whose response was read completely for the next request"""
+        if response.will_close:
+            conn.close()
+            return
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def get(self, path, timeout):
+        """GET a path and return the body, gunzipped if the server compressed it"""
+        conn, response = self.request(path, timeout)
+        try:
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            raise
+        self.release(conn, response)
+        if response.getheader('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def stream(self, path, timeout, size=1 << 16):
+        """GET a path and yield the body as text in chunks as it arrives"""
+        conn, response = self.request(path, timeout)
+        gunzip = None
+        if response.getheader('Content-Encoding') == 'gzip':
+            gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        text = codecs.getincrementaldecoder('utf-8')()
+        try:
+            while True:
+                chunk = response.read(size)
+                if not chunk:
+                    break
+                if gunzip is not None:
+                    chunk = gunzip.decompress(chunk)
+                yield text.decode(chunk)
+        except BaseException:
+            conn.close()
+            raise
+        self.release(conn, response)
+
+
+def stream_rows(chunks, key='data'):
+    """Rows of the JSON array at key in a streamed response, {"data": [[..], ..]},
+    decoded one at a time so the response is never held in memory"""
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = -1  # position in buf once the array has been found
+    for chunk in chunks:
+        buf += chunk
+        if pos < 0:
+            start = buf.find(f'"{key}"')
+            start = buf.find('[', start) if start >= 0 else -1
+            if start < 0:
+                continue
+            pos = start + 1
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buf):
+                break
+            if buf[pos] == ']':
+                return
+            try:
+                row, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                break  # the row continues in the next chunk
+            yield row
+        buf, pos = buf[pos:], 0
+    if pos < 0:
+        return  # no rows in the response
+    raise ValueError(f'truncated {key} array')
+
+
+class threading_wsgi_server(ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = True
+
+
+class quiet_handler(simple_server.WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def item_family(instance, name, label, items):
+    """Gauge with one series per item of an API result e.g. {domain: count}"""
+    family = GaugeMetricFamily(name, name.replace('_', ' '),
+                               labels=['instance', label])
+    for k, v in items.items():
+        family.add_metric([instance, str(k)], v)
+    return family
+
+
+class pihole_exporter():
+    """Poller of one Pi-hole. The metric families are built from its last poll
+    of the API, so an item that is no longer returned, e.g. a domain dropping
+    out of topItems, has no series any more. Every series has an instance
+    label, the address of the Pi-hole."""
+
+    def __init__(self, url, auth, extended=False, timeout=5, queries_timeout=30,
+                 ttl=10, refresh_interval=0, top_n=100, top_clients=50):
         self.url = url
+        self.instance = url
         self.auth = auth
-        self.api_url = f'http://{self.url}/admin/api.php'
+        self.api_path = '/admin/api.php'
         self.httpd = None
         self.extended = extended
 
-        self.summary_raw_url = self.api_url + '?summaryRaw'
-        self.top_item_url = self.api_url + '?topItems=100'
-        self.top_sources_url = self.api_url + '?getQuerySources=100'
-        self.forward_destinations_url = self.api_url + '?getForwardDestinations'
-        self.query_types_url = self.api_url + '?getQueryTypes'
-        self.get_all_queries_url = self.api_url + '?getAllQueries'
-        self.metrics_handler.add('pihole_top_sources', 'client')
-        self.metrics_handler.add('pihole_top_queries', 'domain')
-        self.metrics_handler.add('pihole_top_ads', 'domain')
-        self.metrics_handler.add('pihole_forward_destinations', 'resolver')
-        self.metrics_handler.add('pihole_query_type', 'query_type')
-        self.metrics_handler.add('pihole_client_queries',
-                                 ['hostname', 'domain', 'answer_type'])
-
-    def get_json(self, url):
+        # endpoint -> (query string, timeout in seconds)
+        self.endpoints = {
+            'summaryRaw': ('summaryRaw', timeout),
+            'topItems': ('topItems=100', timeout),
+            'getQuerySources': ('getQuerySources=100', timeout),
+            'getForwardDestinations': ('getForwardDestinations', timeout),
+            'getQueryTypes': ('getQueryTypes', timeout),
+        }
+        if self.extended:
+            self.endpoints['getAllQueries'] = ('getAllQueries', queries_timeout)
+        # query counts since the exporter started, only the queries since the
+        # cursor are fetched. top_n (hostname, domain, answer_type) series are
+        # admitted and counted from then on, the other queries are counted per
+        # hostname and answer type with the domain set to other. Candidates for
+        # the free series are ranked by their recent counts. The hostnames are
+        # admitted the same way, up to top_clients, the queries of the other
+        # clients are counted with the hostname and the domain set to other.
+        self.cursor = None
+        self.query_counts = {}
+        self.candidates = {}
+        self.top_n = top_n
+        self.clients = set()
+        self.client_candidates = {}
+        self.top_clients = top_clients
+        # the API calls of a scrape are made concurrently over keep-alive connections
+        self.pool = connection_pool(self.url, len(self.endpoints))
+        self.executor = ThreadPoolExecutor(len(self.endpoints), 'pihole-api')
+        # scrapes are served from the last poll of the API while it is younger
+        # than ttl, a single poll at a time refreshes it. With the background
+        # refresher a scrape only polls if the refresher fell behind.
+        self.ttl = max(ttl, refresh_interval)
+        self.refresh_interval = refresh_interval
+        self.refresh_lock = threading.RLock()
+        self.polled = 0.0  # time of the last poll
+        self.updated = 0.0  # time of the last successful poll
+        # NaN until the first successful poll, there is no data to be old
+        snapshot_age.labels(self.instance).set_function(
+            lambda: time.time() - self.updated if self.updated else math.nan)
+        self.snapshot = {}  # endpoint -> JSON of its last successful call
+        self.client_queries = {}  # exported query counts
+
+    def path(self, query):
+        path = f'{self.api_path}?{query}'
         if self.auth:
-            url += "&auth=%s" % self.auth
-        response = urllib.request.urlopen(url)
-        data = response.read()
-        text = data.decode('utf-8')
-        io = StringIO(text)
-        json_text = json.load(io)
-        return json_text
-
-    def get_summary(self):
-        summary_raw = self.get_json(self.summary_raw_url)
-
-        for i in summary_raw:
-            if i == "status":
-                if summary_raw[i] == 'enabled':
-                    self.metrics_handler.add_update(f'pihole_{i}', 1)
-                else:
-                    self.metrics_handler.add_update(f'pihole_{i}', 0)
-            elif i == "gravity_last_updated":
-                self.metrics_handler.add_update(f'pihole_{i}',summary_raw[i]['absolute'])
-            else:
-                self.metrics_handler.add_update(f'pihole_{i}',summary_raw[i])
-
-    def get_exteneded_metrics(self):
-        aq = self.get_json(self.get_all_queries_url)
-        if aq:
-            client_data = dict()
-            for i in aq['data']:
-                hostname = i[3]
-                domain = i[2]
-                answer_type = i[4]
-                if not hostname in client_data:
-                    client_data[hostname] = dict()
-                if not domain in client_data[hostname]:
-                    client_data[hostname][domain] = dict()
-                if not answer_type in client_data[hostname][domain]:
-                    client_data[hostname][domain][answer_type] = 1
-                else:
-                    client_data[hostname][domain][answer_type] += 1
-            self.metrics_handler.update('pihole_client_queries', client_data)
+            path += '&auth=%s' % quote(self.auth)
+        return path
 
-    def generate_latest(self):
-        self.get_summary()
-
-        top_items = self.get_json(self.top_item_url)
-        if top_items:
-            for item in top_items:
-                self.metrics_handler.update(f'pihole_{item}',top_items[item],
-                )
-        top_sources = self.get_json(self.top_sources_url)
-        if top_sources:
-            self.metrics_handler.update('pihole_top_sources',
-                                        top_sources['top_sources'])
-
-        fw_dest = self.get_json(self.forward_destinations_url)
-        if fw_dest:
-            self.metrics_handler.update('pihole_forward_destinations',
-                                        fw_dest['forward_destinations'])
-
-        qt = self.get_json(self.query_types_url)
-        if qt:
-            self.metrics_handler.update('pihole_query_type', qt['querytypes'])
+    def get_json(self, endpoint):
+        query, timeout = self.endpoints[endpoint]
+        start = time.perf_counter()
+        try:
+            data = self.pool.get(self.path(query), timeout)
+            # json parses the bytes directly, no decoded copy
+            return json.loads(data)
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            api_errors.labels(self.instance, endpoint).inc()
+            print(f'{self.instance} {endpoint} failed: {e}')
+            return None
+        finally:
+            api_request_seconds.labels(self.instance, endpoint).observe(
+                time.perf_counter() - start)
 
+    def get_queries(self):
+        """Count the queries logged since the last poll by (hostname, domain,
+        answer_type), streaming the rows of getAllQueries from the cursor. The
+        first poll starts with the last 24 hours the Pi-hole keeps in memory."""
+        query, timeout = self.endpoints['getAllQueries']
+        until = int(time.time()) - 1
+        since = self.cursor if self.cursor is not None else until - 86400
+        start = time.perf_counter()
+        new = collections.Counter()
+        try:
+            chunks = self.pool.stream(
+                self.path(f'{query}&from={since}&until={until}'), timeout)
+            for row in stream_rows(chunks):
+                new[(row[3], row[2], row[4])] += 1
+        except (http.client.HTTPException, OSError, ValueError,
+                IndexError) as e:
+            # nothing is counted, the same range is fetched again next time
+            api_errors.labels(self.instance, 'getAllQueries').inc()
+            print(f'{self.instance} getAllQueries failed: {e}')
+            return None
+        finally:
+            api_request_seconds.labels(self.instance, 'getAllQueries').observe(
+                time.perf_counter() - start)
+        self.cursor = until + 1
+        return new
+
+    def fetch_all(self):
+        """Call every endpoint concurrently, endpoint -> JSON or None if it failed"""
+        futures = {e: self.executor.submit(self.get_json, e)
+                   for e in self.endpoints if e != 'getAllQueries'}
         if self.extended:
-            self.get_exteneded_metrics()
+            futures['getAllQueries'] = self.executor.submit(self.get_queries)
+        return {e: f.result() for e, f in futures.items()}
+
+    def fold_clients(self, new_queries, other='other'):
+        """Queries of the hostnames not admitted as clients under the other hostname"""
+        clients = self.clients
+        candidates = self.client_candidates
+        for (host, _, _), n in new_queries.items():
+            if host not in clients:
+                candidates[host] = candidates.get(host, 0) + n
+        # like the query series, a client once admitted stays
+        if len(clients) < self.top_clients and candidates:
+            ranked = sorted(candidates, key=candidates.get, reverse=True)
+            for host in ranked[:self.top_clients - len(clients)]:
+                clients.add(host)
+                del candidates[host]
+        if len(candidates) > 2 * self.top_clients:
+            ranked = sorted(candidates, key=candidates.get, reverse=True)
+            self.client_candidates = {
+                k: candidates[k] for k in ranked[:2 * self.top_clients]}
+        folded = {}
+        for k, n in new_queries.items():
+            if k[0] not in clients:
+                k = (other, other, k[2])
+            folded[k] = folded.get(k, 0) + n
+        return folded
 
-        return generate_latest()
+    def count_queries(self, new_queries, other='other'):
+        new_queries = self.fold_clients(new_queries, other)
+        counts = self.query_counts
+        candidates = self.candidates
+        admitted = sum(1 for k in counts if k[1] != other)
+        for k, n in new_queries.items():
+            if k not in counts:
+                candidates[k] = candidates.get(k, 0) + n
+        # a series once exported is never folded into other again, so every
+        # series only goes up and the label set only grows up to top_n
+        if admitted < self.top_n and candidates:
+            ranked = sorted(candidates, key=candidates.get, reverse=True)
+            for k in ranked[:self.top_n - admitted]:
+                if k[1] != other:
+                    counts[k] = 0
+                    del candidates[k]
+        for k, n in new_queries.items():
+            if k[1] == other or k not in counts:
+                k = (k[0], other, k[2])
+            counts[k] = counts.get(k, 0) + n
+        # memory is bounded to twice the exported series
+        if len(candidates) > 2 * self.top_n:
+            ranked = sorted(candidates, key=candidates.get, reverse=True)
+            self.candidates = {k: candidates[k] for k in ranked[:2 * self.top_n]}
+        self.client_queries = dict(counts)
+
+    def refresh(self):
+        """Poll the API and update the metrics, one poll at a time"""
+        with self.refresh_lock:
+            self.polled = time.time()
+            refreshes.labels(self.instance).inc()
+            results = self.fetch_all()
+            # a failed call keeps the result of the last successful one
+            snapshot = dict(self.snapshot)
+            for endpoint, result in results.items():
+                if result is not None and endpoint != 'getAllQueries':
+                    snapshot[endpoint] = result
+            if results.get('getAllQueries') is not None:
+                self.count_queries(results['getAllQueries'])
+            self.snapshot = snapshot
+            if results['summaryRaw'] is not None:
+                self.updated = self.polled
+
+    def refresh_if_stale(self):
+        """Poll the API unless the last poll is younger than the TTL. Callers
+        arriving during a poll wait for it instead of starting another one"""
+        if time.time() - self.polled < self.ttl:
+            return
+        with self.refresh_lock:
+            if time.time() - self.polled < self.ttl:
+                return  # refreshed while waiting for the lock
+            self.refresh()
+
+    def start_refresher(self):
+        """Poll the API every refresh_interval seconds from a daemon thread"""
+        def run():
+            while True:
+                started = time.monotonic()
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f'{self.instance} refresh failed: {e}')
+                time.sleep(max(0.0, self.refresh_interval -
+                               (time.monotonic() - started)))
+
+        if self.refresh_interval > 0:
+            threading.Thread(target=run, name=f'pihole-refresher-{self.instance}',
+                             daemon=True).start()
+
+    def families(self):
+        """Metric families of the last poll"""
+        snapshot = self.snapshot
+
+        summary_raw = snapshot.get('summaryRaw') or {}
+        for i, value in summary_raw.items():
+            if i == 'status':
+                value = 1 if value == 'enabled' else 0
+            elif i == 'gravity_last_updated':
+                value = value['absolute']
+            if isinstance(value, (int, float)):
+                family = GaugeMetricFamily(f'pihole_{i}'.lower(),
+                                           f'pihole {i}'.replace('_', ' '),
+                                           labels=['instance'])
+                family.add_metric([self.instance], value)
+                yield family
+
+        for endpoint in ('topItems', 'getQuerySources',
+                         'getForwardDestinations', 'getQueryTypes'):
+            for item, items in (snapshot.get(endpoint) or {}).items():
+                if item in ITEMS and isinstance(items, dict):
+                    yield item_family(self.instance, *ITEMS[item], items)
+
+        if self.extended:
+            client_queries = CounterMetricFamily(
+                'pihole_client_queries',
+                'Queries per client, domain and answer type since the exporter '
+                'started, the domains beyond --top-queries and the clients beyond '
+                '--top-clients counted as other',
+                labels=['instance', 'hostname', 'domain', 'answer_type'])
+            for labels, n in self.client_queries.items():
+                client_queries.add_metric(
+                    [self.instance, *(str(k) for k in labels)], n)
+            yield client_queries
+
+
+class pihole_collector():
+    """Collector of the metrics of several Pi-holes. The stale ones are polled
+    concurrently on every collect, each on its own thread with its own
+    timeouts. A Pi-hole not done within the scrape timeout is served from its
+    last poll and its poll carries on in the background, so a slow or dead
+    Pi-hole does not delay the others."""
+
+    def __init__(self, targets, scrape_timeout=8, registry=REGISTRY):
+        self.targets = targets
+        self.scrape_timeout = scrape_timeout
+        self.executor = ThreadPoolExecutor(len(targets), 'pihole-target')
+        self.polls = {}  # target -> poll in progress, at most one each
+        self.registry = registry
+        registry.register(self)
+
+    def describe(self):
+        return []  # collect() polls the API, not at registration
+
+    def collect(self):
+        # with the refreshers running the snapshots are normally fresh already,
+        # a poll still running from an earlier scrape is not waited for again
+        started = []
+        for target in self.targets:
+            poll = self.polls.get(target)
+            if poll is None or poll.done():
+                poll = self.executor.submit(target.refresh_if_stale)
+                self.polls[target] = poll
+                started.append(poll)
+        wait(started, self.scrape_timeout)
+
+        # one family per metric with the series of every Pi-hole
+        merged = {}
+        for target in self.targets:
+            for family in target.families():
+                if family.name in merged:
+                    merged[family.name].samples.extend(family.samples)
+                else:
+                    merged[family.name] = family
+        return list(merged.values())
+
+    def generate_latest(self):
+        return generate_latest(self.registry)
 
     def make_wsgi_app(self):
-        def prometheus_app(environ, start_response):
-            output = self.generate_latest()
-            status = str('200 OK')
-            headers = [(str('Content-type'), str('text/plain'))]
-            start_response(status, headers)
-            return [output]
+        return make_wsgi_app(self.registry)
 
-        return prometheus_app
+    def make_server(self, interface, port):
+        """Serve the metrics until interrupted"""
+        httpd = simple_server.make_server(
+            interface, port, self.make_wsgi_app(), threading_wsgi_server,
+            handler_class=quiet_handler)
+        httpd.serve_forever()
 
 
 def get_authentication_token():
@@ -141,7 +502,7 @@ def get_authentication_token():
             lines = f.readlines()
             for line in lines:
                 if line.startswith('WEBPASSWORD'):
-                    token = line.split('=')[1]
+                    token = line.split('=', 1)[1].strip()
                     return token
             return None
     except (FileNotFoundError):
@@ -151,7 +512,11 @@ def get_authentication_token():
 def main():
     parser = argparse.ArgumentParser(description='pihole_exporter')
     parser.add_argument(
-        '-o', '--pihole', help='pihole adress', default='pi.hole')
+        '-o',
+        '--pihole',
+        action='append',
+        help='pihole adress as [auth@]host[:port], repeat it for several pi-holes',
+        default=None)
     parser.add_argument(
         '-p',
         '--port',
@@ -164,23 +529,73 @@ def main():
         help='interface pihole_exporter will listen on',
         default='0.0.0.0')
     parser.add_argument(
-        '-a', '--auth', help='Pihole password hash', default=None)
+        '-a',
+        '--auth',
+        help='Pihole password hash of the pi-holes without their own',
+        default=None)
     parser.add_argument(
         '-e',
         '--extended-metrics',
         help="Extended pihole metrics",
         action='store_true',
         default=False)
+    parser.add_argument(
+        '-n',
+        '--top-queries',
+        type=int,
+        help='client query series of the extended metrics, the rest counted as other',
+        default=100)
+    parser.add_argument(
+        '--top-clients',
+        type=int,
+        help='client hostnames of the extended metrics, the rest counted as other',
+        default=50)
+    parser.add_argument(
+        '-t',
+        '--timeout',
+        type=float,
+        help='timeout of each Pi-hole API call in seconds',
+        default=5)
+    parser.add_argument(
+        '--queries-timeout',
+        type=float,
+        help='timeout of the getAllQueries call of the extended metrics',
+        default=30)
+    parser.add_argument(
+        '--scrape-timeout',
+        type=float,
+        help='seconds a scrape waits for the polls it starts, then serves the '
+        'last poll, keep it below the Prometheus scrape_timeout',
+        default=8)
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        help='seconds scrapes are served from the last poll of the API',
+        default=10)
+    parser.add_argument(
+        '-r',
+        '--refresh-interval',
+        type=float,
+        help='poll the API in the background every N seconds, 0 polls on scrape',
+        default=0)
     args = parser.parse_args()
 
-    #args.pihole = '192.168.1.5'
-    args.auth = '0a3b6a2866a9e8b549c7906b167a5233374818f6b23c809a61ddac003ca89074'
     auth_token = args.auth
     if auth_token == None:
         auth_token = get_authentication_token()
 
-    exporter = pihole_exporter(args.pihole, auth_token, args.extended_metrics)
-    exporter.make_server(args.interface, args.port)
+    targets = []
+    for pihole in args.pihole or ['pi.hole']:
+        auth, _, address = pihole.rpartition('@')
+        target = pihole_exporter(address, auth or auth_token,
+                                 args.extended_metrics, args.timeout,
+                                 args.queries_timeout, args.cache_ttl,
+                                 args.refresh_interval, args.top_queries,
+                                 args.top_clients)
+        target.start_refresher()
+        targets.append(target)
+    collector = pihole_collector(targets, args.scrape_timeout)
+    collector.make_server(args.interface, args.port)
 
 
 if __name__ == '__main__':
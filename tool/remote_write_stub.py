@@ -0,0 +1,166 @@
+"""
+Stub Prometheus remote-write receiver for testing the --remote_write push of the PWS client
+
+    python tool/remote_write_stub.py --port 9201 --fail 3
+    python main.py --folder /tmp --remote_write http://localhost:9201/api/v1/write
+
+Decodes every pushed WriteRequest (snappy, then protobuf) and checks it the way a receiver
+would - the headers, the labels sorted by name with __name__ first, the samples of a series in
+time order - and prints a line per request with the series and sample counts.
+--fail answers the first requests with a 503 to exercise the retry and the retry buffer.
+"""
+
+import argparse
+import struct
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    """Protobuf varint at a position, returns the value and the next position"""
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def snappy_decompress(data: bytes) -> bytes:
+    """Snappy block format, literals and copies"""
+    size, pos = read_varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 3
+        if kind == 0:  # literal
+            n = tag >> 2
+            if n >= 60:
+                extra = n - 59
+                n = int.from_bytes(data[pos : pos + extra], "little")
+                pos += extra
+            out += data[pos : pos + n + 1]
+            pos += n + 1
+            continue
+        if kind == 1:
+            length = ((tag >> 2) & 7) + 4
+            offset = ((tag >> 5) << 8) | data[pos]
+            pos += 1
+        elif kind == 2:
+            length = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos : pos + 2], "little")
+            pos += 2
+        else:
+            length = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos : pos + 4], "little")
+            pos += 4
+        if offset == 0 or offset > len(out):
+            raise ValueError("bad snappy copy offset")
+        for _ in range(length):  # copies may overlap their own output
+            out.append(out[-offset])
+    if len(out) != size:
+        raise ValueError(f"snappy length {len(out)} != {size}")
+    return bytes(out)
+
+
+def fields(data: bytes):
+    """Fields of a protobuf message as (number, wire type, value)"""
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = read_varint(data, pos)
+        elif wire == 1:
+            value, pos = data[pos : pos + 8], pos + 8
+        elif wire == 2:
+            n, pos = read_varint(data, pos)
+            value, pos = data[pos : pos + n], pos + n
+        elif wire == 5:
+            value, pos = data[pos : pos + 4], pos + 4
+        else:
+            raise ValueError(f"unsupported wire type {wire}")
+        yield number, wire, value
+
+
+def decode(body: bytes) -> list[tuple[dict, list[tuple[float, int]]]]:
+    """WriteRequest as a list of (labels, [(value, timestamp ms)]), ValueError if invalid"""
+    series = []
+    for number, _, ts in fields(body):
+        if number != 1:
+            continue
+        labels: list[tuple[str, str]] = []
+        samples: list[tuple[float, int]] = []
+        for n, _, v in fields(ts):
+            if n == 1:
+                label = {k: x.decode() for k, _, x in fields(v)}
+                labels.append((label.get(1, ""), label.get(2, "")))
+            elif n == 2:
+                value, timestamp = 0.0, 0
+                for k, _, x in fields(v):
+                    if k == 1:
+                        (value,) = struct.unpack("<d", x)
+                    elif k == 2:
+                        timestamp = x - (1 << 64) if x >= 1 << 63 else x
+                samples.append((value, timestamp))
+        names = [k for k, _ in labels]
+        if names != sorted(names) or len(set(names)) != len(names):
+            raise ValueError(f"labels not sorted or repeated: {names}")
+        if "__name__" not in names:
+            raise ValueError("series without __name__")
+        if [t for _, t in samples] != sorted(t for _, t in samples):
+            raise ValueError(f"samples out of order in {dict(labels)}")
+        series.append((dict(labels), samples))
+    return series
+
+
+class Handler(BaseHTTPRequestHandler):
+    fail = 0  # requests still to answer with a 503
+    requests = 0
+    samples = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cls = type(self)
+        if cls.fail > 0:
+            cls.fail -= 1
+            self.send_error(503, "stub outage")
+            return
+        try:
+            if self.headers.get("Content-Encoding") != "snappy":
+                raise ValueError("Content-Encoding is not snappy")
+            if self.headers.get("Content-Type") != "application/x-protobuf":
+                raise ValueError("Content-Type is not application/x-protobuf")
+            series = decode(snappy_decompress(body))
+        except (ValueError, IndexError, struct.error) as e:
+            print(f"invalid request: {e}", file=sys.stderr)
+            self.send_error(400, str(e))
+            return
+        count = sum(len(s) for _, s in series)
+        cls.requests += 1
+        cls.samples += count
+        stations = {labels.get("station") for labels, _ in series}
+        print(
+            f"request {cls.requests}: {len(body)} bytes, {len(series)} series, "
+            f"{count} samples, {len(stations)} stations, {cls.samples} samples in total"
+        )
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="remote_write_stub")
+    parser.add_argument("--port", type=int, help="Listening port", default=9201)
+    parser.add_argument(
+        "--fail", type=int, help="Answer the first requests with a 503", default=0
+    )
+    args = parser.parse_args()
+    Handler.fail = args.fail
+    print(f"Receiving remote-write on http://localhost:{args.port}/api/v1/write")
+    ThreadingHTTPServer(("", args.port), Handler).serve_forever()
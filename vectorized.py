@@ -0,0 +1,237 @@
+"""
+Vectorised weather calculations for the PWS client
+NumPy versions of the functions in weather.py and of Schema.localise in schema.py, taking and returning
+whole columns of telemetry so that years of history or many stations are processed in one pass.
+
+The results follow the branch logic and the rounding of the scalar functions exactly.
+Python's round() rounds the exact decimal value of a float, so values within a hair of a
+rounding tie are handed to the scalar function instead of trusting np.rint.
+NumPy's log and pow may differ from math's in the last bit, which only matters at those ties
+and for the unrounded FeelsLike (equal to within 1e-12).
+Missing values are NaN, where the scalar function would raise (e.g. log of 0% humidity) the
+result is NaN or inf.
+"""
+
+from typing import Callable
+
+import numpy as np
+
+import weather
+from schema import SCHEMA
+
+TIE: float = 1e-9  # distance from a rounding tie handed to the scalar function
+
+
+def _round(x: np.ndarray, ndigits: int, scalar=None, *args: np.ndarray) -> np.ndarray:
+    """Round like Python's round(x, ndigits)
+
+    Args:
+        x (np.ndarray): values to round
+        ndigits (int): number of decimals
+        scalar (optional): scalar function recomputing the rounded value from args at the ties,
+            defaults to round() of x itself
+        args (np.ndarray): inputs of the scalar function
+
+    Returns:
+        np.ndarray: rounded values
+    """
+    scale = 10.0**ndigits
+    y = x * scale
+    out = np.rint(y) / scale
+    tie = np.abs(y - np.floor(y) - 0.5) < TIE
+    for i in np.flatnonzero(tie):
+        if scalar is None:
+            out[i] = round(float(x[i]), ndigits)
+        else:
+            out[i] = scalar(*(float(a[i]) for a in args))
+    return out
+
+
+def FtoC(T: np.ndarray) -> np.ndarray:
+    """Convert Fahrenheit to Celsius
+
+    Args:
+        T (np.ndarray): Temperature values in Fahrenheit
+
+    Returns:
+        np.ndarray: Temperature values in Celsius
+    """
+    return _round((T - 32) / 1.8, 1)
+
+
+def InHgtoHPa(P: np.ndarray) -> np.ndarray:
+    """Convert inches of mercury to hectopascal
+
+    Args:
+        P (np.ndarray): Pressure in inHg
+
+    Returns:
+        np.ndarray: Pressure in hPa
+    """
+    return _round(P / 0.029529983071445, 1)
+
+
+def MphtoKmh(S: np.ndarray) -> np.ndarray:
+    """Convert miles per hour to kilometres per hour
+
+    Args:
+        S (np.ndarray): Speed in mph
+
+    Returns:
+        np.ndarray: Speed in Km/h
+    """
+    return _round(S * 1.609344, 1)
+
+
+def WindChillIndex(T: np.ndarray, W: np.ndarray) -> np.ndarray:
+    """Wind chill index/factor, see weather.WindChillIndex
+
+    Args:
+        T (np.ndarray): Temperature in Celsius
+        W (np.ndarray): Wind speed in Km/H
+
+    Returns:
+        np.ndarray: wind chill index/factor
+    """
+    with np.errstate(invalid="ignore"):
+        Wp = np.power(W, 0.16)
+    WC = 13.112 + (0.6215 * T) - 11.37 * Wp + 0.3965 * T * Wp
+    # Only for Temp < 10 °C and wind > 5Km/h
+    return np.where(
+        (T < 10) | (W < 5), 0.0, _round(WC, 0, weather.WindChillIndex, T, W)
+    )
+
+
+def Frostpoint(T: np.ndarray, Ts: np.ndarray) -> np.ndarray:
+    """Frost point temperature, see weather.Frostpoint
+
+    Args:
+        T (np.ndarray): Temperature in Celsius
+        Ts (np.ndarray):  Dew Point temperature in Celsius
+
+    Returns:
+        np.ndarray: frost point temperature in Celsius
+    """
+    Ts_K = 273.15 + Ts
+    T_K = 273.15 + T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frostpoint_k = (
+            Ts_K - T_K + 2671.02 / ((2954.61 / T_K) + 2.193665 * np.log(T_K) - 13.3448)
+        )
+    return _round(frostpoint_k - 273.15, 1, weather.Frostpoint, T, Ts)
+
+
+def Dewpoint(T: np.ndarray, RH: np.ndarray) -> np.ndarray:
+    """Dew point temperature, see weather.Dewpoint
+
+    Args:
+        T (np.ndarray): Temperature in Celsius
+        RH (np.ndarray): Relative humidity as %
+
+    Returns:
+        np.ndarray: dew Point temperature in Celsius
+    """
+    A = 17.27
+    B = 237.7
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = ((A * T) / (B + T)) + np.log(RH / 100.0)
+        return _round((B * alpha) / (A - alpha), 1, weather.Dewpoint, T, RH)
+
+
+def FeelsLike(T: np.ndarray, W: np.ndarray, RH: np.ndarray) -> np.ndarray:
+    """Metservice "Feels Like" temperature, see weather.FeelsLike
+
+    Args:
+        T (np.ndarray): Temperature in Celsius
+        W (np.ndarray): Wind speed in Km/H
+        RH (np.ndarray): Relative humidity as %
+
+    Returns:
+        np.ndarray: Feels like temperature
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Dew point calculation
+        alpha = ((17.27 * T) / (237.7 + T)) + np.log(RH / 100.0)
+        DP = (237.7 * alpha) / (17.27 - alpha)
+
+        # Apparent temperature calculation
+        Wms = (W * 1000) / 3600  # Km/h -> m/s
+        AT = T + 0.33 * DP - 0.7 * Wms - 4.0
+
+        # Windchill index
+        Wp = np.power(W, 0.16)
+        WC = 13.112 + (0.6215 * T) - 11.37 * Wp + 0.3965 * T * Wp
+
+    # Windchill, Metservice rollover or the max of Apparent and Measured Temp
+    return np.where(
+        (T < 10) & (W > 4),
+        WC,
+        np.where(
+            (T > 11) & (T < 15),
+            T - ((T - DP) * (14 - T) / 4),
+            np.where(AT > T, AT, T),
+        ),
+    )
+
+
+# (source unit, target unit) -> column converter, the vectorised schema.UNITS
+UNITS: dict[tuple[str, str], Callable[[np.ndarray], np.ndarray]] = {
+    ("°F", "°C"): FtoC,
+    ("inHg", "hPa"): InHgtoHPa,
+    ("mph", "km/h"): MphtoKmh,
+}
+
+# field -> column converter, for the fields of the schema not sent in the exported unit
+CONVERTERS: dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    f.name: UNITS[(f.unit, f.target)]
+    for f in SCHEMA
+    if f.derive is None and f.unit != f.target
+}
+
+
+def ConvertColumns(columns: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Convert the imperial telemetry columns (Fahrenheit, inHg, miles) into metric,
+        the columns that are not there are skipped
+
+    Args:
+        columns (dict[str, np.ndarray]): float64 column per telemetry field
+
+    Returns:
+        dict[str, np.ndarray]: Converted telemetry columns
+    """
+    for k, c in CONVERTERS.items():
+        if k in columns:
+            columns[k] = c(columns[k])
+    return columns
+
+
+def DeriveColumns(columns: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Calculate the dew point, frost point, wind chill index and "Feels Like" columns
+        from the metric telemetry
+
+    Args:
+        columns (dict[str, np.ndarray]): float64 column per telemetry field
+
+    Returns:
+        dict[str, np.ndarray]: telemetry columns including the calculated ones
+    """
+    columns["dewpt"] = Dewpoint(columns["tempf"], columns["humidity"])
+    columns["frostpt"] = Frostpoint(columns["tempf"], columns["dewpt"])
+    columns["chillpt"] = WindChillIndex(columns["tempf"], columns["windspeedmph"])
+    columns["feelslike"] = FeelsLike(
+        columns["tempf"], columns["windspeedmph"], columns["humidity"]
+    )
+    return columns
+
+
+def LocaliseColumns(columns: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Column version of Schema.localise in schema.py - converts the imperial telemetry into metric
+        and calculates the dew point, frost point, wind chill index and "Feels Like"
+
+    Args:
+        columns (dict[str, np.ndarray]): float64 column per telemetry field
+
+    Returns:
+        dict[str, np.ndarray]: Converted and calculated telemetry columns
+    """
+    return DeriveColumns(ConvertColumns(columns))
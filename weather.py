@@ -0,0 +1,158 @@
+"""
+Weather calculations for the PWS client
+Unit conversions and the derived telemetry - dew point, frost point, wind chill index and "Feels Like".
+Array versions of these for batches of records are in vectorized.py
+"""
+
+import math
+
+
+def FtoC(T: float) -> float:
+    """Convert Fahrenheit to Celsius
+
+    Args:
+        T (float): Temperature value in Fahrenheit
+
+    Returns:
+        float: Temperature value in Celsius
+    """
+    return round((T - 32) / 1.8, 1) if T is not None else 0
+
+
+def CtoF(T: float) -> float:
+    """Convert Fahrenheit to Celsius
+
+    Args:
+        T (float): Temperature value in Fahrenheit
+
+    Returns:
+        float: Temperature value in Celsius
+    """
+    return round((T * 1.8) + 32, 1) if T is not None else 0
+
+
+def InHgtoHPa(P: float) -> float:
+    """Convert inches of mercury to hectopascal
+        1 hPa = 0.029529983071445 inHg
+        1 inch of mercury = ±33.86 millibars or hPa.
+        sealevel is ±29.29inHg or 1013mb @ 1000feet or 305m
+        The air pressure at sea level is 1018 hPa (QNH)
+
+    Args:
+        P (float): Pressure in inHg
+
+    Returns:
+        float: Pressure in hPa
+    """
+    return round(P / 0.029529983071445, 1)
+
+
+def MphtoKmh(S: float) -> float:
+    """Convert miles per hour to kilometres per hour, 1mile = 1.609344Km
+
+    Args:
+        S (float): Speed in mph
+
+    Returns:
+        float: Speed in Km/h
+    """
+    return round(S * 1.609344, 1)
+
+
+def WindChillIndex(T: float, W: float) -> float:
+    """Wind chill index/factor as based on the formula from
+        https://en.wikipedia.org/wiki/Wind_chill
+    Args:
+        T (float): Temperature in Celsius
+        W (float): Wind speed in Km/H
+
+    Returns:
+        float: wind chill index/factor
+    """
+    # Only for Temp < 10 °C and wind > 5Km/h
+    if T < 10 or W < 5:
+        return 0
+    return round(
+        13.112
+        + (0.6215 * T)
+        - 11.37 * math.pow(W, 0.16)
+        + 0.3965 * T * math.pow(W, 0.16),
+        0,
+    )
+
+
+def Frostpoint(T: float, Ts: float) -> float:  # in °C
+    """Calculates the frost point temperature as per the formulae and constants in
+        https://docs.vaisala.com/r/M211280EN-D/en-US/GUID-10D5B48D-8D47-40AF-9F4F-953C3C05CE13/GUID-060D9333-9043-49F3-9575-1C2AF978BBF9
+
+    Args:
+        T (float): Temperature in Celsius
+        Ts (float):  Dew Point temperature in Celsius
+
+    Returns:
+        float: frost point temperature in Celsius
+    """
+    Ts_K = 273.15 + Ts
+    T_K = 273.15 + T
+    frostpoint_k = (
+        Ts_K - T_K + 2671.02 / ((2954.61 / T_K) + 2.193665 * math.log(T_K) - 13.3448)
+    )
+    return round(frostpoint_k - 273.15, 1)
+
+
+def Dewpoint(T: float, RH: float) -> float:  # in °C
+    """Dew point as calculated in https://en.wikipedia.org/wiki/Dew_point
+        Specifically the a & b constants from 1974 Psychrometry and Psychrometric Charts.
+    Args:
+        T (float): Temperature in Celsius
+        RH (float): Relative humidity as %
+
+    Returns:
+        float: dew Point temperature in Celsius
+    """
+    A = 17.27
+    B = 237.7
+    alpha = ((A * T) / (B + T)) + math.log(RH / 100.0)
+    return round((B * alpha) / (A - alpha), 1)
+
+
+def FeelsLike(T: float, W: float, RH: float) -> float:
+    """A feels like temperature value as per https://blog.metservice.com/FeelsLikeTemp
+        This function combines three formula to produce one of four temperatures
+        - Feels like temperature
+        - Apparent temperature
+        - Metservice rollover temperature
+        - Actual measured temperature
+
+    Args:
+        T (float): Temperature in Celsius
+        W (float): Wind speed in Km/H
+        RH (float): Relative humidity as %
+
+    Returns:
+        float: Feels like temperature
+    """
+    # Dew point calculation - see above for details
+    alpha = ((17.27 * T) / (237.7 + T)) + math.log(RH / 100.0)
+    DP = (237.7 * alpha) / (17.27 - alpha)
+
+    # Apparent temperature calculation
+    Wms = (W * 1000) / 3600  # Km/h -> m/s
+    AT = T + 0.33 * DP - 0.7 * Wms - 4.0
+
+    # Windchill index
+    WC = (
+        13.112
+        + (0.6215 * T)
+        - 11.37 * math.pow(W, 0.16)
+        + 0.3965 * T * math.pow(W, 0.16)
+    )
+    # Windchill
+    if T < 10 and W > 4:
+        return WC
+
+    # Metservice rollover
+    if T > 11 and T < 15:
+        return T - ((T - DP) * (14 - T) / 4)
+    # Max of Apparent or Measured Temp
+    return max(T, AT)
@@ -0,0 +1,178 @@
+"""
+Background batch writer for the PWS client
+Records are queued by the request handlers and written by a separate thread in group commits,
+so the file (or database) I/O never sits on the telemetry ingest path.
+
+    BatchWriter - bounded queue + writer thread, hands batches of records to a sink
+    JSONLogSink - sink appending JSON encoded records to a text file (pws.txt)
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable
+
+from prometheus_client import Counter, Gauge, Histogram
+
+FSYNC_POLICIES: list[str] = ["never", "batch", "second"]
+
+writer_depth = Gauge(
+    "pws_writer_queue_depth", "Records waiting in the writer queue", ["writer"]
+)
+writer_latency = Histogram(
+    "pws_writer_write_seconds",
+    "Time taken to write one batch of records",
+    ["writer"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+writer_records = Counter(
+    "pws_writer_records_total", "Records written by the writer", ["writer"]
+)
+writer_dropped = Counter(
+    "pws_writer_dropped_total",
+    "Records dropped because the writer queue was full or the write failed",
+    ["writer"],
+)
+
+_STOP = object()  # end of queue marker
+
+
+class JSONLogSink:
+    """Append JSON encoded records, one per line, to a text file.
+    The file stays open between batches and is synced as per the fsync policy
+
+        never  - flush to the OS only
+        batch  - fsync after every batch
+        second - fsync at most once a second
+    """
+
+    def __init__(self, path: str, fsync: str = "never") -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync}")
+        self.path = path
+        self.fsync = fsync
+        self.f = None
+        self.synced: float = 0.0
+
+    def __call__(self, batch: list[dict]) -> None:
+        if self.f is None:
+            self.f = open(self.path, "a")
+        self.f.write("".join(f"{json.dumps(r)}\n" for r in batch))
+        self.f.flush()
+        if self.fsync == "batch" or (
+            self.fsync == "second" and time.monotonic() - self.synced >= 1.0
+        ):
+            os.fsync(self.f.fileno())
+            self.synced = time.monotonic()
+
+    def close(self) -> None:
+        if self.f is not None:
+            if self.fsync != "never":
+                os.fsync(self.f.fileno())
+            self.f.close()
+            self.f = None
+
+
+class BatchWriter:
+    """Group commit writer. Records are put on a bounded in-memory queue and a background
+    thread hands them to the sink in batches of up to batch_size records, waiting no longer
+    than linger seconds for a batch to fill up.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sink: Callable[[list[Any]], None],
+        batch_size: int = 100,
+        linger: float = 1.0,
+        maxsize: int = 10000,
+    ) -> None:
+        """
+        Args:
+            name (str): writer name, used as the "writer" label of the metrics
+            sink (Callable): called with each batch, may have a close() method
+            batch_size (int): maximum number of records per write
+            linger (float): maximum seconds a record waits for the batch to fill
+            maxsize (int): maximum number of queued records, further records are dropped
+        """
+        self.name = name
+        self.sink = sink
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self.run, name=f"{name}-writer")
+        self.thread.daemon = True  # closed explicitly, see close()
+        self.latency = writer_latency.labels(name)
+        self.records = writer_records.labels(name)
+        self.dropped = writer_dropped.labels(name)
+        writer_depth.labels(name).set_function(self.queue.qsize)
+
+    def start(self) -> "BatchWriter":
+        self.thread.start()
+        return self
+
+    def put(self, record: Any) -> bool:
+        """Queue a record without blocking
+
+        Args:
+            record (Any): record handed to the sink
+
+        Returns:
+            bool: False if the queue was full and the record dropped
+        """
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped.inc()
+            return False
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Flush every queued record to the sink and stop the writer thread"""
+        if not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            print(f"{self.name} writer did not drain its queue, records were lost")
+            return
+        self.thread.join(timeout)
+
+    def write(self, batch: list[Any]) -> None:
+        start = time.perf_counter()
+        try:
+            self.sink(batch)
+            self.records.inc(len(batch))
+        except Exception as e:
+            self.dropped.inc(len(batch))
+            print(f"{self.name} writer failed: {e}")
+        self.latency.observe(time.perf_counter() - start)
+
+    def run(self) -> None:
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = (
+                        self.queue.get(timeout=timeout)
+                        if timeout > 0
+                        else self.queue.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self.write(batch)
+        close = getattr(self.sink, "close", None)
+        if close is not None:
+            close()